@@ -0,0 +1,232 @@
+"""
+In-process stand-in for the Domoticz Python plugin framework.
+
+Provides the ``Domoticz`` module API used by plugin.py (Device, Connection,
+logging, Heartbeat) together with the ``Devices`` and ``Parameters`` globals
+that Domoticz normally injects into the plugin namespace. Connection events
+(onConnect/onMessage/onDisconnect) are queued and delivered on the calling
+thread by ``dispatch()``, mimicking the single plugin thread of Domoticz.
+"""
+
+import http.client
+import queue
+import sys
+import threading
+import time
+
+Devices = {}
+Parameters = {}
+
+counters = {
+    "device_updates": 0,
+    "device_creates": 0,
+    "device_deletes": 0,
+    "log_lines": 0,
+    "errors": 0,
+}
+
+heartbeat_interval = [10]
+debugging = [0]
+echo = [False]
+log_lines = []
+
+_events = queue.Queue()
+
+
+def _log(level, message):
+    counters["log_lines"] += 1
+    log_lines.append((level, message))
+    del log_lines[:-2000]
+    if echo[0] and (level != "Debug" or debugging[0]):
+        print(f"[{level}] {message}", file=sys.stderr)
+
+
+def Log(message):
+    _log("Log", message)
+
+
+def Status(message):
+    _log("Status", message)
+
+
+def Error(message):
+    counters["errors"] += 1
+    _log("Error", message)
+
+
+def Debug(message):
+    _log("Debug", message)
+
+
+def Debugging(level):
+    debugging[0] = level
+
+
+def Heartbeat(interval):
+    heartbeat_interval[0] = interval
+
+
+class Device:
+    def __init__(self, Name="", Unit=0, TypeName="", Type=0, Subtype=0, Switchtype=0,
+                 Image=0, Options=None, Used=0, Description=""):
+        self.Name = Name
+        self.Unit = Unit
+        self.TypeName = TypeName
+        self.Type = Type
+        self.SubType = Subtype
+        self.SwitchType = Switchtype
+        self.Image = Image
+        self.Options = Options or {}
+        self.Used = Used
+        self.Description = Description
+        self.nValue = 0
+        self.sValue = ""
+        self.LastLevel = 0
+        self.TimedOut = 0
+
+    def Create(self):
+        if self.Unit in Devices:
+            raise RuntimeError(f"Unit {self.Unit} already exists")
+        if not 1 <= self.Unit <= 255:
+            raise RuntimeError(f"Unit {self.Unit} outside 1-255")
+        Devices[self.Unit] = self
+        counters["device_creates"] += 1
+
+    def Update(self, nValue=None, sValue=None, Name=None, Description=None, Options=None,
+               TimedOut=None, **kwargs):
+        if nValue is not None:
+            self.nValue = nValue
+        if sValue is not None:
+            self.sValue = sValue
+        if Name is not None:
+            self.Name = Name
+        if Description is not None:
+            self.Description = Description
+        if Options is not None:
+            self.Options = Options
+        if TimedOut is not None:
+            self.TimedOut = TimedOut
+        counters["device_updates"] += 1
+
+    def Delete(self):
+        Devices.pop(self.Unit, None)
+        counters["device_deletes"] += 1
+
+    def __str__(self):
+        return f"Unit {self.Unit}: {self.Name} n={self.nValue} s={self.sValue!r}"
+
+
+class Connection:
+    """HTTP connection whose I/O runs on a helper thread, events via dispatch()"""
+
+    def __init__(self, Name, Transport="TCP/IP", Protocol="HTTP", Address="", Port="80", Baud=None):
+        self.Name = Name
+        self.Transport = Transport
+        self.Protocol = Protocol
+        self.Address = Address
+        self.Port = Port
+        self._http = None
+        self._connected = False
+        self._connecting = False
+        self._lock = threading.Lock()
+
+    def Connect(self):
+        self._connecting = True
+        threading.Thread(target=self._connect, daemon=True).start()
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.Protocol == "HTTPS" else http.client.HTTPConnection
+        try:
+            self._http = cls(self.Address, int(self.Port), timeout=30)
+            self._http.connect()
+            self._connected = True
+            status, description = 0, "Connected"
+        except OSError as e:
+            status, description = 1, str(e)
+        self._connecting = False
+        _events.put(("onConnect", self, status, description))
+
+    def Connected(self):
+        return self._connected
+
+    def Connecting(self):
+        return self._connecting
+
+    def Send(self, Message, Delay=0):
+        threading.Thread(target=self._send, args=(dict(Message),), daemon=True).start()
+
+    def _send(self, message):
+        with self._lock:
+            try:
+                body = message.get("Data")
+                if isinstance(body, str):
+                    body = body.encode("utf-8")
+                self._http.request(message.get("Verb", "GET"), message.get("URL", "/"),
+                                   body=body, headers=message.get("Headers", {}))
+                response = self._http.getresponse()
+                data = response.read()
+                _events.put(("onMessage", self, {
+                    "Status": str(response.status),
+                    "Headers": dict(response.getheaders()),
+                    "Data": data,
+                }))
+            except (OSError, http.client.HTTPException):
+                self._connected = False
+                _events.put(("onDisconnect", self))
+
+    def Disconnect(self):
+        if self._http:
+            self._http.close()
+        was_connected = self._connected
+        self._connected = False
+        if was_connected:
+            _events.put(("onDisconnect", self))
+
+
+def dispatch(plugin_module, timeout=0.0):
+    """Deliver queued connection events to the plugin; returns number handled"""
+    handled = 0
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            event = _events.get(timeout=remaining) if remaining > 0 else _events.get_nowait()
+        except queue.Empty:
+            return handled
+        name, args = event[0], event[1:]
+        getattr(plugin_module, name)(*args)
+        handled += 1
+
+
+def pendingEvents():
+    return _events.qsize()
+
+
+def install(parameters=None, keep_devices=False):
+    """Register this module as ``Domoticz`` and reset all state"""
+    module = sys.modules[__name__]
+    sys.modules["Domoticz"] = module
+    if not keep_devices:
+        Devices.clear()
+    Parameters.clear()
+    Parameters.update(parameters or {})
+    for key in counters:
+        counters[key] = 0
+    del log_lines[:]
+    while not _events.empty():
+        _events.get_nowait()
+    return module
+
+
+def loadPlugin(path, parameters=None, keep_devices=False):
+    """Import plugin.py with the stub installed and the Domoticz globals injected
+    keep_devices=True simulates a plugin restart: devices created before survive
+    """
+    import importlib.util
+    install(parameters, keep_devices)
+    spec = importlib.util.spec_from_file_location("plugin", path)
+    plugin = importlib.util.module_from_spec(spec)
+    plugin.Devices = Devices
+    plugin.Parameters = Parameters
+    spec.loader.exec_module(plugin)
+    return plugin
@@ -0,0 +1,400 @@
+"""
+Local mock of the Pi-hole v6 REST API for offline benchmarking.
+
+Serves /api/auth, /api/stats/summary, /api/lists, /api/groups, /api/domains,
+/api/clients, /api/queries, /api/dns/blocking, /api/action/gravity and the PUT endpoints used by plugin.py, with configurable
+latency, error rate and entity counts. Responses are gzip encoded for clients that accept it unless
+``gzip=False``. Request and byte counters are kept in ``MockPiHole.stats``.
+
+Run standalone: python3 bench/mock_pihole.py --lists 1000 --port 8080
+"""
+
+import argparse
+import collections
+import gzip
+import json
+import random
+import secrets
+import socket
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockPiHole:
+    """Pi-hole state plus the HTTP server exposing it"""
+
+    def __init__(self, lists=20, groups=5, password="secret", latency=0.0, error_rate=0.0,
+                 port=0, seed=1, session_validity=1800, domains=10, gzip=True):
+        self.password = password
+        self.gzip = gzip
+        self.gravity_step = 0.05  # Seconds between two lines of the gravity output
+        self.latency = latency
+        self.error_rate = error_rate
+        self.down = False  # Drop every request without an answer, like an unreachable Pi-hole
+        self.session_validity = session_validity
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.sessions = {}
+        self.stats = {}
+        self.resetStats()
+        self.groups = [self.makeGroup(i) for i in range(groups)]
+        self.lists = [self.makeList(i + 1) for i in range(lists)]
+        self.summary = {
+            "queries": {"total": 12000, "blocked": 1500, "percent_blocked": 12.5,
+                        "unique_domains": 900, "forwarded": 7000, "cached": 3500},
+            "clients": {"active": 12, "total": 30},
+            "gravity": {"domains_being_blocked": 150000, "last_update": 1700000000},
+        }
+        self.blocking = {"blocking": "enabled", "timer": None}
+        self.clients = [(f"192.168.1.{10 + i}", name) for i, name in
+                        enumerate(("tablet", "laptop", "phone", "tv", "console"))]
+        self.domains = ["www.youtube.com", "i.ytimg.com", "www.tiktok.com", "ads.example.net",
+                        "api.github.com", "time.apple.com", "www.wikipedia.org", "cdn.discordapp.com"]
+        self.queries = collections.deque(maxlen=20000)  # Query log, oldest first
+        self.domain_entries = [self.makeDomain(i + 1) for i in range(domains)]
+        self.client_entries = [{"client": ip, "name": name, "comment": None, "groups": [0],
+                                "id": i + 1, "date_added": 1700000000, "date_modified": 1700000000}
+                               for i, (ip, name) in enumerate(self.clients)]
+        self.next_query_id = 1
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.makeHandler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def blockingState(self):
+        """Blocking state as /api/dns/blocking reports it; a timed pause ends on its own"""
+        until = self.blocking["timer"]
+        if until is not None and until <= time.time():
+            self.blocking = {"blocking": "enabled", "timer": None}
+        return {"blocking": self.blocking["blocking"],
+                "timer": None if self.blocking["timer"] is None else round(self.blocking["timer"] - time.time(), 1),
+                "took": 0.0001}
+
+    def resetStats(self):
+        with self.lock:
+            self.stats.clear()
+            self.stats.update({"requests": 0, "bytes_in": 0, "bytes_out": 0,
+                               "auth": 0, "connections": 0, "by_endpoint": {}})
+
+    def makeGroup(self, index):
+        return {"name": "Default" if index == 0 else f"Group {index}",
+                "comment": None if index == 0 else f"Comment {index}",
+                "enabled": True, "id": index,
+                "date_added": 1700000000, "date_modified": 1700000000}
+
+    def makeDomain(self, domain_id):
+        return {"domain": f"site{domain_id}.example.com", "unicode": f"site{domain_id}.example.com",
+                "type": "deny" if domain_id % 2 else "allow",
+                "kind": "regex" if domain_id % 5 == 0 else "exact",
+                "comment": None, "groups": [0], "enabled": True, "id": domain_id,
+                "date_added": 1700000000, "date_modified": 1700000000}
+
+    def makeList(self, list_id):
+        return {"address": f"https://lists.example.org/list-{list_id}.txt",
+                "comment": f"List {list_id}",
+                "groups": [0] if list_id % 3 else [0, min(1, len(self.groups) - 1)],
+                "enabled": list_id % 4 != 0, "id": list_id,
+                "date_added": 1700000000, "date_modified": 1700000000,
+                "type": "block", "date_updated": 1700000000,
+                "number": 1000 + list_id, "invalid_domains": 0, "abp_entries": 0,
+                "status": 2}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def tick(self, queries=50):
+        """Advance the query counters as if Pi-hole had resolved more queries"""
+        with self.lock:
+            q = self.summary["queries"]
+            q["total"] += queries
+            q["blocked"] += queries // 8
+            q["forwarded"] += queries // 2
+            q["cached"] += queries // 4
+            q["percent_blocked"] = round(100.0 * q["blocked"] / q["total"], 2)
+            # Spread the queries over the last moments, never before the previous ones (IDs follow time)
+            first = time.time() - queries * 0.001
+            if self.queries:
+                first = max(first, self.queries[-1]["time"])
+            for i in range(queries):
+                ip, name = self.random.choice(self.clients)
+                domain = self.random.choice(self.domains)
+                self.queries.append({
+                    "id": self.next_query_id, "time": first + i * 0.001, "type": "A",
+                    "domain": domain, "cname": None,
+                    "status": "GRAVITY" if domain.startswith("ads.") else "FORWARDED",
+                    "client": {"ip": ip, "name": name}, "dnssec": "UNKNOWN",
+                    "reply": {"type": "IP", "time": 0.5}, "list_id": None, "upstream": None, "ede": None})
+                self.next_query_id += 1
+
+    def makeHandler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                with mock.lock:
+                    mock.stats["connections"] += 1
+
+            def do_GET(self):
+                self.route("GET")
+
+            def do_POST(self):
+                self.route("POST")
+
+            def do_PUT(self):
+                self.route("PUT")
+
+            def do_DELETE(self):
+                self.route("DELETE")
+
+            def route(self, verb):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                parsed = urllib.parse.urlparse(self.path)
+                path = parsed.path
+                with mock.lock:
+                    mock.stats["requests"] += 1
+                    mock.stats["bytes_in"] += length
+                    key = f"{verb} {path if not path.startswith(('/api/lists/', '/api/groups/', '/api/domains/', '/api/clients/')) else path.rsplit('/', 1)[0] + '/*'}"
+                    mock.stats["by_endpoint"][key] = mock.stats["by_endpoint"].get(key, 0) + 1
+                if mock.latency:
+                    time.sleep(mock.latency)
+                if mock.down:
+                    self.close_connection = True
+                    return
+                if mock.error_rate and mock.random.random() < mock.error_rate:
+                    return self.reply(500, {"error": {"key": "mock", "message": "Injected failure"}})
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    return self.reply(400, {"error": {"key": "bad_request", "message": "Invalid JSON"}})
+                query = urllib.parse.parse_qs(parsed.query)
+                if path == "/api/auth":
+                    return self.handleAuth(verb, body)
+                if not self.authorized(query):
+                    return self.reply(401, {"error": {"key": "unauthorized", "message": "Unauthorized"}})
+                handler = getattr(self, "handle_" + verb + path.replace("/api", "", 1).split("/")[1], None)
+                if path.startswith("/api/stats/summary") and verb == "GET":
+                    return self.reply(200, dict(mock.summary))
+                if handler is None:
+                    return self.reply(404, {"error": {"key": "not_found", "message": "Not found"}})
+                return handler(path, query, body)
+
+            def authorized(self, query):
+                sid = self.headers.get("X-FTL-SID") or (query.get("sid") or [None])[0]
+                with mock.lock:
+                    expires = mock.sessions.get(sid)
+                    if expires is None:
+                        return False
+                    if expires < time.time():
+                        del mock.sessions[sid]
+                        return False
+                    mock.sessions[sid] = time.time() + mock.session_validity
+                return True
+
+            def handleAuth(self, verb, body):
+                if verb == "POST":
+                    with mock.lock:
+                        mock.stats["auth"] += 1
+                    if body.get("password") != mock.password:
+                        return self.reply(401, {"session": {"valid": False, "totp": False, "sid": None,
+                                                            "validity": -1, "message": "password incorrect"}})
+                    sid = secrets.token_urlsafe(16)
+                    with mock.lock:
+                        mock.sessions[sid] = time.time() + mock.session_validity
+                    return self.reply(200, {"session": {"valid": True, "totp": False, "sid": sid,
+                                                        "csrf": secrets.token_urlsafe(16),
+                                                        "validity": mock.session_validity,
+                                                        "message": "password correct"}})
+                if verb == "DELETE":
+                    sid = self.headers.get("X-FTL-SID")
+                    with mock.lock:
+                        found = mock.sessions.pop(sid, None)
+                    return self.reply(204 if found else 401, None)
+                valid = self.authorized({})
+                return self.reply(200 if valid else 401, {"session": {
+                    "valid": valid, "totp": False, "sid": None,
+                    "validity": mock.session_validity if valid else -1,
+                    "message": None}})
+
+            def handle_GETqueries(self, path, query, body):
+                since = float(query.get("from", ["0"])[0])
+                length = int(query.get("length", ["100"])[0])
+                start = int(query.get("start", ["0"])[0])
+                with mock.lock:
+                    # Newest first; a cursor pins the pages to the rows that existed at the first page
+                    cursor = int(query["cursor"][0]) if "cursor" in query else (
+                        mock.queries[-1]["id"] if mock.queries else None)
+                    rows = [q for q in reversed(mock.queries) if q["time"] >= since and q["id"] <= (cursor or 0)]
+                    total = len(mock.queries)
+                return self.reply(200, {"queries": rows[start:start + length], "cursor": cursor,
+                                        "recordsTotal": total, "recordsFiltered": len(rows),
+                                        "earliest_timestamp": mock.queries[0]["time"] if total else 0,
+                                        "draw": 0})
+
+            def handle_GETdns(self, path, query, body):
+                with mock.lock:
+                    return self.reply(200, mock.blockingState())
+
+            def handle_POSTdns(self, path, query, body):
+                if "blocking" not in body:
+                    return self.reply(400, {"error": {"key": "bad_request", "message": "No blocking"}})
+                timer = body.get("timer")
+                with mock.lock:
+                    mock.blocking = {"blocking": "enabled" if body["blocking"] else "disabled",
+                                     "timer": None if body["blocking"] or not timer else time.time() + timer}
+                    return self.reply(200, mock.blockingState())
+
+            def handle_POSTaction(self, path, query, body):
+                if path != "/api/action/gravity":
+                    return self.reply(404, {"error": {"key": "not_found", "message": "Not found"}})
+                # Stream the progress like FTL does: chunked text, spinners redrawn with \r
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                lines = ["  [i] Neutrino emissions detected...\n", "\x1b[K  [\u2713] Preparing new gravity database\n"]
+                lines += [f"  [i] Target: {lst['address']}\n  [i] Status: Pending...\r\x1b[K  [\u2713] Status: Retrieval successful\n"
+                          for lst in mock.lists[:5]]
+                lines += ["  [\u2713] Building tree\n", "  [\u2713] Done.\n"]
+                for line in lines:
+                    data = line.encode("utf-8")
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                    self.wfile.flush()
+                    time.sleep(mock.gravity_step)
+                self.wfile.write(b"0\r\n\r\n")
+                with mock.lock:
+                    mock.summary["gravity"]["domains_being_blocked"] += 1000
+                    mock.summary["gravity"]["last_update"] = int(time.time())
+
+            def handle_GETlists(self, path, query, body):
+                with mock.lock:
+                    return self.reply(200, {"lists": [dict(lst) for lst in mock.lists]})
+
+            def handle_GETgroups(self, path, query, body):
+                with mock.lock:
+                    return self.reply(200, {"groups": [dict(grp) for grp in mock.groups]})
+
+            def handle_GETdomains(self, path, query, body):
+                with mock.lock:
+                    return self.reply(200, {"domains": [dict(d) for d in mock.domain_entries]})
+
+            def handle_GETclients(self, path, query, body):
+                with mock.lock:
+                    return self.reply(200, {"clients": [dict(c) for c in mock.client_entries]})
+
+            def handle_PUTdomains(self, path, query, body):
+                domain_type, kind, domain = path.split("/api/domains/", 1)[1].split("/", 2)
+                domain = urllib.parse.unquote(domain)
+                with mock.lock:
+                    for entry in mock.domain_entries:
+                        if (entry["domain"], entry["type"], entry["kind"]) == (domain, domain_type, kind):
+                            for key in ("enabled", "comment", "groups", "type", "kind"):
+                                if key in body:
+                                    entry[key] = body[key]
+                            entry["date_modified"] = int(time.time())
+                            return self.reply(200, {"domains": [dict(entry)], "processed": {
+                                "success": [{"item": domain}], "errors": []}})
+                return self.reply(404, {"error": {"key": "not_found", "message": "Not found"}})
+
+            def handle_PUTclients(self, path, query, body):
+                client = urllib.parse.unquote(path.split("/api/clients/", 1)[1])
+                with mock.lock:
+                    for entry in mock.client_entries:
+                        if entry["client"] == client:
+                            for key in ("comment", "groups"):
+                                if key in body:
+                                    entry[key] = body[key]
+                            entry["date_modified"] = int(time.time())
+                            return self.reply(200, {"clients": [dict(entry)], "processed": {
+                                "success": [{"item": client}], "errors": []}})
+                return self.reply(404, {"error": {"key": "not_found", "message": "Not found"}})
+
+            def handle_PUTlists(self, path, query, body):
+                address = urllib.parse.unquote(path.split("/api/lists/", 1)[1])
+                with mock.lock:
+                    for lst in mock.lists:
+                        if lst["address"] == address:
+                            for key in ("enabled", "comment", "groups"):
+                                if key in body:
+                                    lst[key] = body[key]
+                            lst["date_modified"] = int(time.time())
+                            return self.reply(200, {"lists": [dict(lst)], "processed": {
+                                "success": [{"item": address}], "errors": []}})
+                return self.reply(200, {"lists": [], "processed": {
+                    "success": [], "errors": [{"item": address, "error": "not found"}]}})
+
+            def handle_PUTgroups(self, path, query, body):
+                name = urllib.parse.unquote(path.split("/api/groups/", 1)[1])
+                with mock.lock:
+                    for grp in mock.groups:
+                        if grp["name"] == name:
+                            for key in ("enabled", "comment", "name"):
+                                if key in body:
+                                    grp[key] = body[key]
+                            grp["date_modified"] = int(time.time())
+                            return self.reply(200, {"groups": [dict(grp)], "processed": {
+                                "success": [{"item": name}], "errors": []}})
+                return self.reply(200, {"groups": [], "processed": {
+                    "success": [], "errors": [{"item": name, "error": "not found"}]}})
+
+            def reply(self, status, payload):
+                if payload is None:
+                    data = b""
+                else:
+                    payload = dict(payload)
+                    payload["took"] = mock.random.random() / 1000
+                    data = json.dumps(payload).encode("utf-8")
+                encode = mock.gzip and len(data) > 512 and "gzip" in (self.headers.get("Accept-Encoding") or "")
+                if encode:
+                    data = gzip.compress(data, compresslevel=6)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                if encode:
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                with mock.lock:
+                    mock.stats["bytes_out"] += len(data)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--lists", type=int, default=20)
+    parser.add_argument("--groups", type=int, default=5)
+    parser.add_argument("--password", default="secret")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 500")
+    args = parser.parse_args()
+    mock = MockPiHole(lists=args.lists, groups=args.groups, password=args.password,
+                      latency=args.latency, error_rate=args.error_rate, port=args.port)
+    print(f"Mock Pi-hole listening on {mock.url} (password '{args.password}')")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Payload benchmark for the /lists response: plain JSON versus gzip with projected parsing.
+
+Fetches /api/lists from the local Pi-hole mock with the plugin's own
+HttpConnectionPool and decodeJson, once the way the plugin used to (identity
+encoding, every field of every entry kept) and once gzip encoded with the
+entries cut down to the fields the plugin reads. Reports bytes on the wire,
+fetch and parse time, peak memory while reading and parsing the body and the
+memory the parsed payload keeps.
+
+Example: python3 bench/payload_benchmark.py --lists 100 1000 5000
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import domoticz_stub  # noqa: E402
+from mock_pihole import MockPiHole  # noqa: E402
+
+PLUGIN_PATH = os.path.join(os.path.dirname(HERE), "plugin.py")
+LIST_FIELDS = ('id', 'address', 'type', 'comment', 'groups', 'enabled')
+
+
+def login(plugin, mock):
+    pool = plugin.HttpConnectionPool(mock.url)
+    body = json.dumps({"password": mock.password}).encode("utf-8")
+    status, reason, raw, wire = pool.request("POST", "/api/auth", body, {"Content-Type": "application/json"})
+    pool.close()
+    return json.loads(raw)["session"]["sid"]
+
+
+def measure(plugin, mock, sid, compressed, repeat):
+    pool = plugin.HttpConnectionPool(mock.url)
+    headers = {"Accept": "application/json", "X-FTL-SID": sid}
+    fields = None
+    if compressed:
+        headers["Accept-Encoding"] = "gzip"
+        fields = LIST_FIELDS
+
+    fetch_times, parse_times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        status, reason, raw, wire = pool.request("GET", "/api/lists", None, headers)
+        fetched = time.perf_counter()
+        plugin.decodeJson(raw, fields)
+        fetch_times.append(fetched - start)
+        parse_times.append(time.perf_counter() - fetched)
+
+    # Memory is measured in a separate run, tracemalloc slows everything down
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    status, reason, raw, wire = pool.request("GET", "/api/lists", None, headers)
+    payload = plugin.decodeJson(raw, fields)
+    del raw
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    pool.close()
+    return {
+        "wire": wire, "entries": len(payload["lists"]),
+        "fetch_ms": statistics.median(fetch_times) * 1000,
+        "parse_ms": statistics.median(parse_times) * 1000,
+        "peak_kb": (peak - before) / 1024, "kept_kb": (current - before) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare plain and gzip/projected /lists payload handling")
+    parser.add_argument("--lists", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=20, help="fetches per measurement (median is reported)")
+    args = parser.parse_args()
+
+    plugin = domoticz_stub.loadPlugin(PLUGIN_PATH, {})
+    print(f"{'lists':>6} {'mode':<16} {'wire bytes':>11} {'fetch ms':>9} {'parse ms':>9} "
+          f"{'peak kB':>9} {'kept kB':>9}")
+    for lists in args.lists:
+        mock = MockPiHole(lists=lists).start()
+        sid = login(plugin, mock)
+        for compressed, mode in ((False, "plain"), (True, "gzip+projected")):
+            row = measure(plugin, mock, sid, compressed, args.repeat)
+            print(f"{lists:>6} {mode:<16} {row['wire']:>11} {row['fetch_ms']:>9.2f} {row['parse_ms']:>9.2f} "
+                  f"{row['peak_kb']:>9.0f} {row['kept_kb']:>9.0f}")
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
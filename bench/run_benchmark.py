@@ -0,0 +1,217 @@
+"""
+Heartbeat benchmark for plugin.py against the local Pi-hole mock.
+
+Loads the plugin with the Domoticz stub, starts a mock Pi-hole and reports,
+per phase (onStart, onHeartbeat, onCommand): plugin-thread time, wall time
+until all responses were applied, HTTP requests, bytes transferred and
+Device.Update calls.
+
+Example: python3 bench/run_benchmark.py --lists 1000 --latency 0.02
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import domoticz_stub  # noqa: E402
+from mock_pihole import MockPiHole  # noqa: E402
+
+PLUGIN_PATH = os.path.join(os.path.dirname(HERE), "plugin.py")
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.mocks = [MockPiHole(lists=args.lists, groups=args.groups, latency=args.latency,
+                                 error_rate=args.error_rate, seed=1 + index).start() for index in range(args.targets)]
+        self.mock = self.mocks[0]
+        parameters = {key: "" for key in ("Port", "Username", "Mode2", "Mode3", "Mode4", "Mode5")}
+        parameters.update({
+            "Address": ",".join(mock.url for mock in self.mocks), "Password": self.mock.password,
+            "Mode1": str(args.interval), "Mode6": "Debug" if args.debug else "Normal",
+            "HomeFolder": args.home_folder, "Key": "PiHole", "Name": "Pi-hole", "HardwareID": 1,
+        })
+        for item in args.param:
+            key, _, value = item.partition("=")
+            parameters[key] = value
+        domoticz_stub.echo[0] = args.verbose
+        self.parameters = parameters
+        self.plugin = domoticz_stub.loadPlugin(PLUGIN_PATH, parameters)
+        self.rows = []
+        self.tick_times = []
+
+    def settle(self, timeout):
+        """Deliver connection events and heartbeat-driven results until quiet"""
+        deadline = time.monotonic() + timeout
+        handled = 0
+        idle_since = next_tick = time.monotonic()
+        while time.monotonic() < deadline:
+            if self.args.tick and time.monotonic() >= next_tick:
+                # Simulated heartbeat, drains results of the background thread transport
+                next_tick = time.monotonic() + self.args.tick
+                updates = domoticz_stub.counters["device_updates"]
+                start = time.perf_counter()
+                self.plugin.onHeartbeat()
+                self.tick_times.append(time.perf_counter() - start)
+                if domoticz_stub.counters["device_updates"] != updates:
+                    idle_since = time.monotonic()
+            n = domoticz_stub.dispatch(self.plugin, timeout=0.02)
+            handled += n
+            if n:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since > self.args.quiet:
+                break
+        return handled
+
+    def measure(self, phase, action):
+        for mock in self.mocks:
+            mock.resetStats()
+        updates = domoticz_stub.counters["device_updates"]
+        start = time.perf_counter()
+        action()
+        plugin_time = time.perf_counter() - start
+        self.settle(self.args.settle)
+        wall = time.perf_counter() - start
+        stats = [mock.stats for mock in self.mocks]
+        self.rows.append({
+            "phase": phase, "plugin_ms": plugin_time * 1000, "wall_ms": wall * 1000,
+            "requests": sum(s["requests"] for s in stats),
+            "bytes": sum(s["bytes_in"] + s["bytes_out"] for s in stats),
+            "connections": sum(s["connections"] for s in stats),
+            "updates": domoticz_stub.counters["device_updates"] - updates,
+        })
+
+    def run(self):
+        self.measure("onStart", self.plugin.onStart)
+        for _ in range(self.args.heartbeats):
+            for mock in self.mocks:
+                mock.tick()
+            self.measure("onHeartbeat", self.plugin.onHeartbeat)
+            if self.args.heartbeat_sleep:
+                time.sleep(self.args.heartbeat_sleep)
+        unit = self.firstListUnit()
+        if unit is not None:
+            for command in ("Off", "On") * self.args.commands:
+                self.measure("onCommand", lambda: self.plugin.onCommand(unit, command, 0, 0))
+                self.measure("onHeartbeat", self.plugin.onHeartbeat)
+        if self.args.burst:
+            self.measure("burst", self.burst)
+        if self.args.outage:
+            self.outage()
+        self.measure("onStop", self.plugin.onStop)
+        if self.args.restart:
+            # Load the plugin again with the devices of the first run, as after a Domoticz restart
+            self.plugin = domoticz_stub.loadPlugin(PLUGIN_PATH, self.parameters, keep_devices=True)
+            self.measure("restart", self.plugin.onStart)
+            self.measure("restart hb", self.plugin.onHeartbeat)
+            self.measure("onStop", self.plugin.onStop)
+        for mock in self.mocks:
+            mock.stop()
+
+    def burst(self):
+        """Toggle many switches at once, half of them twice, like a schedule firing"""
+        units = [unit for unit, device in sorted(domoticz_stub.Devices.items())
+                 if device.Description.startswith(("ListID:", "GroupID:", "DomainID:", "ClientGroup:"))][:self.args.burst]
+        for unit in units:
+            self.plugin.onCommand(unit, "Off", 0, 0)
+        for unit in units[:len(units) // 2]:
+            self.plugin.onCommand(unit, "On", 0, 0)
+        # Debounced commands are sent from the first heartbeat after the window
+        window = self.plugin._plugin.commands.window
+        if window > 0:
+            time.sleep(window)
+            self.plugin.onHeartbeat()
+
+    def outage(self):
+        """Heartbeats with every tier due while Pi-hole is unreachable, then until it is back"""
+        plugin = self.plugin._plugin
+        breaker = plugin.primary.breaker
+        self.mock.down = True
+        for _ in range(self.args.outage):
+            plugin.scheduler.trigger(*plugin.scheduler.intervals)
+            self.measure("outage hb", self.plugin.onHeartbeat)
+            time.sleep(0.1)
+        self.mock.down = False
+
+        def recover():
+            deadline = time.monotonic() + breaker.max_backoff + 1
+            while breaker.state != breaker.CLOSED and time.monotonic() < deadline:
+                time.sleep(0.05)
+                self.plugin.onHeartbeat()
+                domoticz_stub.dispatch(self.plugin, timeout=0.02)
+        self.measure("recovery", recover)
+
+    def firstListUnit(self):
+        for unit, device in sorted(domoticz_stub.Devices.items()):
+            if device.Description.startswith("ListID:"):
+                return unit
+        return None
+
+    def report(self):
+        print(f"{'phase':<12} {'n':>4} {'plugin ms':>10} {'wall ms':>10} {'p95 wall':>10} "
+              f"{'requests':>9} {'conns':>6} {'bytes':>10} {'updates':>8}")
+        for phase in ("onStart", "onHeartbeat", "onCommand", "burst", "outage hb", "recovery", "restart", "restart hb", "onStop"):
+            rows = [r for r in self.rows if r["phase"] == phase]
+            if not rows:
+                continue
+            walls = sorted(r["wall_ms"] for r in rows)
+            p95 = walls[min(len(walls) - 1, int(round(0.95 * (len(walls) - 1))))]
+            print(f"{phase:<12} {len(rows):>4} "
+                  f"{statistics.mean(r['plugin_ms'] for r in rows):>10.2f} "
+                  f"{statistics.mean(walls):>10.2f} {p95:>10.2f} "
+                  f"{statistics.mean(r['requests'] for r in rows):>9.1f} "
+                  f"{statistics.mean(r['connections'] for r in rows):>6.1f} "
+                  f"{statistics.mean(r['bytes'] for r in rows):>10.0f} "
+                  f"{statistics.mean(r['updates'] for r in rows):>8.1f}")
+        if self.tick_times:
+            print(f"simulated heartbeats: {len(self.tick_times)}, "
+                  f"mean {statistics.mean(self.tick_times) * 1000:.3f} ms, "
+                  f"max {max(self.tick_times) * 1000:.3f} ms")
+        print(f"errors logged: {domoticz_stub.counters['errors']}, devices: {len(domoticz_stub.Devices)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark plugin.py heartbeats against a mock Pi-hole")
+    parser.add_argument("--lists", type=int, default=20)
+    parser.add_argument("--groups", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every mock request")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--heartbeats", type=int, default=10)
+    parser.add_argument("--commands", type=int, default=2, help="Off/On command pairs to send")
+    parser.add_argument("--burst", type=int, default=0,
+                        help="switches toggled at once in a final burst phase")
+    parser.add_argument("--outage", type=int, default=0,
+                        help="heartbeats to run while the mock drops all requests (pair with "
+                             "Mode4=breaker_backoff=0.5 to keep the recovery short)")
+    parser.add_argument("--restart", action="store_true",
+                        help="restart the plugin at the end, keeping its devices and state snapshot")
+    parser.add_argument("--targets", type=int, default=1,
+                        help="mock Pi-holes to start, all passed to the plugin as one comma separated Address")
+    parser.add_argument("--interval", type=int, default=60, help="Mode1 update interval")
+    parser.add_argument("--heartbeat-sleep", type=float, default=0.0,
+                        help="real seconds to wait between heartbeats")
+    parser.add_argument("--settle", type=float, default=5.0,
+                        help="max seconds to wait for async results after each call")
+    parser.add_argument("--quiet", type=float, default=0.1,
+                        help="seconds without events that count as settled")
+    parser.add_argument("--tick", type=float, default=0.0,
+                        help="call onHeartbeat every TICK seconds while settling (use with Mode2=Worker)")
+    parser.add_argument("--param", action="append", default=[],
+                        help="extra plugin Parameters as KEY=VALUE (e.g. Mode2=Async)")
+    parser.add_argument("--home-folder", default=os.path.join(HERE, ".home") + os.sep)
+    parser.add_argument("--debug", action="store_true", help="run the plugin with Mode6=Debug")
+    parser.add_argument("--verbose", action="store_true", help="echo plugin log lines to stderr")
+    args = parser.parse_args()
+    os.makedirs(args.home_folder, exist_ok=True)
+    bench = Bench(args)
+    bench.run()
+    bench.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -12,9 +12,19 @@
             <li>Individual block list enable/disable control</li>
             <li>Individual group enable/disable control</li>
             <li>Scheduler integration for parental controls</li>
+            <li>Built-in weekly schedules for lists and groups, see the README</li>
         </ul>
         <h3>Configuration</h3>
         Enter your Pi-hole URL (e.g., http://10.0.20.4 or http://pi.hole) and Web Interface password.
+        Several Pi-holes are entered comma separated, the first one is the primary; the password is
+        either shared or given per Pi-hole, comma separated in the same order.<br/>
+        Poll Intervals sets separate intervals for statistics, list/group on-off states and the
+        detection of added/removed/renamed lists and groups, e.g. "10;60;3600". Empty uses the Update
+        Interval for statistics and states and syncs structure every 10 minutes.<br/>
+        Advanced Options takes key=value pairs separated by ";", see the README for the available keys.<br/>
+        Connection Mode "Non-blocking" sends all API requests through Domoticz.Connection, so heartbeats and
+        switch commands return immediately and results are applied when Pi-hole answers. "Background thread"
+        performs all HTTP and JSON work on a worker thread and applies the results on the next heartbeat.
         <h3>Documentation</h3>
         See: <a href="https://github.com/voyo/Domoticz_PiHole-Control">https://github.com/voyo/Domoticz_PiHole-Control</a>
     </description>
@@ -22,10 +32,20 @@
         <param field="Address" label="Pi-hole URL" width="300px" required="true" default="http://10.0.20.4"/>
         <param field="Password" label="Web Interface Password" width="300px" required="true" password="true" default=""/>
         <param field="Mode1" label="Update Interval (seconds)" width="75px" required="true" default="60"/>
+        <param field="Mode3" label="Poll Intervals stats;state;sync (seconds)" width="150px" default=""/>
+        <param field="Mode4" label="Advanced Options" width="300px" default=""/>
+        <param field="Mode2" label="Connection Mode" width="250px">
+            <options>
+                <option label="Blocking (urllib)" value="Blocking" default="true"/>
+                <option label="Non-blocking (Domoticz.Connection)" value="Async"/>
+                <option label="Background thread" value="Worker"/>
+            </options>
+        </param>
         <param field="Mode6" label="Debug" width="75px">
             <options>
                 <option label="True" value="Debug"/>
                 <option label="False" value="Normal" default="true"/>
+                <option label="Profile" value="Profile"/>
             </options>
         </param>
     </params>
@@ -33,10 +53,1783 @@
 """
 
 import Domoticz
+import array
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
+import functools
+import hashlib
+import heapq
+import http.client
 import json
-import urllib.request
-import urllib.error
+import os
+import queue
+import random
+import re
+import ssl
+import threading
+import time
 import urllib.parse
+import zlib
+
+
+class ResumingHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS connection that offers the TLS session of a previous connection for resumption"""
+
+    tls_session = None
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=self.host,
+                                              session=self.tls_session)
+
+
+class HttpConnectionPool:
+    """Tiny pool of persistent HTTP/1.1 keep-alive connections to one Pi-hole
+
+    Idle connections are reused by the next request. When a reused connection
+    turns out to have been closed by the server, the request is retried once on
+    a fresh connection. For https the TLS session of the last connection is
+    offered on reconnect so the handshake can be resumed. Gzip encoded bodies
+    are inflated chunk by chunk while they are read.
+    """
+
+    READ_CHUNK = 16384
+    RECONNECT_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                        BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+    def __init__(self, base_url, timeout=5, max_idle=2):
+        parsed = urllib.parse.urlparse(base_url)
+        self.secure = parsed.scheme == 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.secure else 80)
+        self.path_prefix = parsed.path.rstrip('/')
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.ssl_context = ssl.create_default_context() if self.secure else None
+        self.tls_session = None
+        self.idle = []
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+        self.latency_total = 0.0
+        self.latency_count = 0
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request and return (status, reason, body, bytes on the wire); raises OSError/HTTPException"""
+        start = time.monotonic()
+        conn, reused = self.checkout()
+        try:
+            try:
+                response = self.send(conn, method, path, body, headers)
+            except self.RECONNECT_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                # The server dropped the idle keep-alive connection, retry once on a new one
+                self.count('reconnects')
+                conn, reused = self.newConnection(), False
+                response = self.send(conn, method, path, body, headers)
+            data, wire = self.readBody(response)
+        except Exception:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self.checkin(conn)
+
+        with self.lock:
+            self.stats['requests'] += 1
+            self.latency_total += time.monotonic() - start
+            self.latency_count += 1
+            self.stats['bytes_wire'] += wire
+            self.stats['bytes_body'] += len(data)
+        return response.status, response.reason, data, wire
+
+    def readBody(self, response):
+        """Read the body, inflating it as it arrives when the server sent it gzip encoded"""
+        if (response.getheader('Content-Encoding') or '').lower() != 'gzip':
+            data = response.read()
+            return data, len(data)
+        
+        inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = []
+        wire = 0
+        while True:
+            chunk = response.read(self.READ_CHUNK)
+            if not chunk:
+                break
+            wire += len(chunk)
+            chunks.append(inflater.decompress(chunk))
+        chunks.append(inflater.flush())
+        return b"".join(chunks), wire
+
+    def send(self, conn, method, path, body, headers):
+        if conn.sock is None:
+            conn.connect()
+            if self.secure and conn.sock.session_reused:
+                self.count('tls_resumed')
+        conn.request(method, self.path_prefix + path, body=body, headers=headers or {})
+        return conn.getresponse()
+
+    def newConnection(self):
+        self.count('opened')
+        if self.secure:
+            conn = ResumingHTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                           context=self.ssl_context)
+            conn.tls_session = self.tls_session
+            return conn
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def checkout(self):
+        with self.lock:
+            if self.idle:
+                self.stats['reused'] += 1
+                return self.idle.pop(), True
+        return self.newConnection(), False
+
+    def checkin(self, conn):
+        if self.secure and conn.sock is not None:
+            self.tls_session = conn.sock.session
+        with self.lock:
+            if len(self.idle) < self.max_idle:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def describeStats(self):
+        """Connection reuse statistics; the latency average covers requests since the last call"""
+        with self.lock:
+            average = self.latency_total / self.latency_count * 1000 if self.latency_count else 0
+            self.latency_total = 0.0
+            self.latency_count = 0
+            stats = dict(self.stats)
+        text = (f"{stats.get('requests', 0)} requests, {stats.get('opened', 0)} connections opened, "
+                f"{stats.get('reused', 0)} reused, {stats.get('reconnects', 0)} reconnects, "
+                f"{stats.get('bytes_wire', 0) / 1024:.1f} kB received ({stats.get('bytes_body', 0) / 1024:.1f} kB decoded)")
+        if self.secure:
+            text += f", {stats.get('tls_resumed', 0)} TLS sessions resumed"
+        return text + f", avg latency {average:.1f} ms"
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+class BlockingTransport:
+    """Executes Pi-hole API requests synchronously over keep-alive connections and runs the callback inline"""
+
+    def __init__(self, base_url, sid_provider, timeout=5, workers=1, deadline=None, metrics=None,
+                 projections=None):
+        self.pool = HttpConnectionPool(base_url, timeout, max_idle=max(2, workers))
+        self.sid_provider = sid_provider
+        self.metrics = metrics
+        self.projections = projections or {}  # Maps GET endpoint -> entry fields to keep
+        self.workers = workers
+        self.deadline = deadline or timeout
+        self.executor = None
+        self.batched = None
+
+    def request(self, verb, endpoint, data=None, callback=None, authenticated=True):
+        """Send a request and call callback(status, result); status is None on network errors"""
+        if self.batched is not None:
+            self.batched.append((verb, endpoint, data, callback, authenticated))
+            return
+        status, result = self.execute(verb, endpoint, data, authenticated)
+        if callback:
+            callback(status, result)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Collect the requests made inside the block and send them concurrently on exit
+        A nested batch joins the one already collecting.
+        """
+        if self.batched is not None:
+            yield
+            return
+        self.batched = []
+        try:
+            yield
+        except Exception:
+            self.batched = None
+            raise
+        requests, self.batched = self.batched, None
+        for request, status, result in self.executeMany(requests):
+            callback = request[3]
+            if callback:
+                callback(status, result)
+
+    def executeMany(self, requests):
+        """Execute independent requests on a bounded thread pool within the cycle deadline
+        Returns (request, status, result) in request order; requests that missed the
+        deadline get status None.
+        """
+        if len(requests) <= 1 or self.workers <= 1:
+            return [(request, *self.execute(*request[:3], request[4])) for request in requests]
+
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                                  thread_name_prefix="PiHoleFetch")
+        start = time.monotonic()
+        futures = [self.executor.submit(self.execute, verb, endpoint, data, authenticated)
+                   for verb, endpoint, data, callback, authenticated in requests]
+        done, not_done = concurrent.futures.wait(futures, timeout=self.deadline)
+
+        results = []
+        missed = []
+        for request, future in zip(requests, futures):
+            if future in done:
+                results.append((request, *future.result()))
+            else:
+                future.cancel()
+                missed.append(request[1])
+                results.append((request, None, None))
+
+        Domoticz.Debug(f"Fetched {len(done)} of {len(requests)} requests concurrently in "
+                       f"{(time.monotonic() - start) * 1000:.1f} ms")
+        if missed:
+            Domoticz.Error(f"Pi-hole did not answer {', '.join(missed)} within the {self.deadline}s cycle deadline")
+        return results
+
+    def execute(self, verb, endpoint, data, authenticated):
+        headers = {'Accept': 'application/json', 'Accept-Encoding': 'gzip'}
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        sid = self.sid_provider()
+        if authenticated and sid:
+            headers['X-FTL-SID'] = sid
+
+        start = time.perf_counter()
+        try:
+            status, reason, raw, wire = self.pool.request(verb, f"/api{endpoint}", body, headers)
+        except Exception as e:
+            Domoticz.Debug(f"API {verb} error on {endpoint}: {str(e)}")
+            return None, None
+        received = time.perf_counter()
+
+        if status >= 400:
+            Domoticz.Debug(f"HTTP Error on {verb} {endpoint}: {status} - {reason}")
+        try:
+            result = decodeJson(raw, self.projections.get(endpoint) if verb == "GET" else None)
+        except ValueError as e:
+            Domoticz.Debug(f"Invalid JSON from {endpoint}: {str(e)}")
+            result = None
+        if self.metrics:
+            self.metrics.request(verb, endpoint, received - start, wire, time.perf_counter() - received)
+        return status, result
+
+    def describeStats(self):
+        return self.pool.describeStats()
+
+    def isBusy(self):
+        return False
+
+    def onConnect(self, Connection, Status, Description):
+        pass
+
+    def onMessage(self, Connection, Data):
+        pass
+
+    def onDisconnect(self, Connection):
+        pass
+
+    def onHeartbeat(self):
+        pass
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.pool.close()
+
+
+class AsyncTransport:
+    """Sends Pi-hole API requests over a Domoticz.Connection without blocking the plugin thread
+
+    Requests are queued and sent one at a time over a single keep-alive HTTP
+    connection. The state machine moves idle -> connecting -> idle -> waiting
+    (request sent) -> idle; each response completes the request at the head of
+    the queue via its callback and the next request is sent straight away.
+    A request that times out moves to closing until the connection is dropped.
+    """
+
+    CONNECTION_NAME = "PiHoleAPI"
+
+    STATE_IDLE = "idle"
+    STATE_CONNECTING = "connecting"
+    STATE_WAITING = "waiting"
+    STATE_CLOSING = "closing"
+
+    def __init__(self, base_url, sid_provider, timeout=5, name=None, metrics=None, projections=None):
+        parsed = urllib.parse.urlparse(base_url)
+        self.name = name or self.CONNECTION_NAME  # Tells the connections of several Pi-holes apart
+        self.metrics = metrics
+        self.projections = projections or {}
+        self.secure = parsed.scheme == 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.secure else 80)
+        self.path_prefix = parsed.path.rstrip('/')
+        self.sid_provider = sid_provider
+        self.timeout = timeout
+        self.connection = None
+        self.pending = collections.deque()
+        self.current = None
+        self.state = self.STATE_IDLE
+        self.state_since = time.time()
+        self.stats = collections.Counter()
+        self.latency_total = 0.0
+        self.latency_count = 0
+
+    def request(self, verb, endpoint, data=None, callback=None, authenticated=True):
+        """Queue a request; callback(status, result) runs from onMessage/onDisconnect"""
+        self.pending.append((verb, endpoint, data, callback, authenticated))
+        self.pump()
+
+    def batch(self):
+        # A single Domoticz.Connection answers requests one after another
+        return contextlib.nullcontext()
+
+    def isBusy(self):
+        return self.state != self.STATE_IDLE or bool(self.pending)
+
+    def setState(self, state):
+        self.state = state
+        self.state_since = time.time()
+
+    def pump(self):
+        """Connect or send the next queued request when the connection is free"""
+        if self.state != self.STATE_IDLE or not self.pending:
+            return
+
+        if self.connection is None or not self.connection.Connected():
+            if self.connection is None:
+                self.connection = Domoticz.Connection(Name=self.name, Transport="TCP/IP",
+                                                      Protocol="HTTPS" if self.secure else "HTTP",
+                                                      Address=self.host, Port=str(self.port))
+            Domoticz.Debug(f"Connecting to Pi-hole at {self.host}:{self.port}")
+            self.stats['opened'] += 1
+            self.setState(self.STATE_CONNECTING)
+            self.connection.Connect()
+            return
+
+        self.current = self.pending.popleft()
+        verb, endpoint, data, callback, authenticated = self.current
+
+        headers = {'Accept': 'application/json', 'Accept-Encoding': 'gzip', 'Host': self.host,
+                   'Connection': 'keep-alive'}
+        sid = self.sid_provider()
+        if authenticated and sid:
+            headers['X-FTL-SID'] = sid
+
+        message = {'Verb': verb, 'URL': f"{self.path_prefix}/api{endpoint}", 'Headers': headers}
+        if data is not None:
+            headers['Content-Type'] = 'application/json'
+            message['Data'] = json.dumps(data)
+
+        Domoticz.Debug(f"Sending {verb} {endpoint} ({len(self.pending)} more queued)")
+        self.setState(self.STATE_WAITING)
+        self.connection.Send(message)
+
+    def complete(self, status, result):
+        """Finish the in-flight request and move on to the next one"""
+        request, self.current = self.current, None
+        if request is not None and status is not None:
+            self.stats['requests'] += 1
+            self.latency_total += time.time() - self.state_since
+            self.latency_count += 1
+        self.setState(self.STATE_IDLE)
+        if request is not None:
+            callback = request[3]
+            if callback:
+                callback(status, result)
+        self.pump()
+
+    def failPending(self):
+        """Fail every queued request, e.g. when Pi-hole cannot be reached"""
+        pending = list(self.pending)
+        self.pending.clear()
+        for verb, endpoint, data, callback, authenticated in pending:
+            if callback:
+                callback(None, None)
+
+    def onConnect(self, Connection, Status, Description):
+        if Connection.Name != self.name:
+            return
+        self.setState(self.STATE_IDLE)
+        if Status != 0:
+            Domoticz.Debug(f"Failed to connect to Pi-hole: {Description}")
+            self.failPending()
+            return
+        self.pump()
+
+    def onMessage(self, Connection, Data):
+        if Connection.Name != self.name or self.current is None:
+            return
+
+        verb, endpoint = self.current[0], self.current[1]
+        status = int(Data.get('Status', 0))
+        received = time.perf_counter()
+        raw = Data.get('Data') or b""
+        try:
+            if isinstance(raw, bytes) and raw[:2] == b"\x1f\x8b":
+                # Domoticz normally inflates gzip bodies itself, but not every version does
+                raw = zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+            result = decodeJson(raw, self.projections.get(endpoint) if verb == "GET" else None)
+        except Exception as e:
+            Domoticz.Debug(f"Invalid JSON from {endpoint}: {str(e)}")
+            result = None
+        if self.metrics:
+            self.metrics.request(verb, endpoint, time.time() - self.state_since, len(Data.get('Data') or b""),
+                                 time.perf_counter() - received)
+
+        if status >= 400:
+            Domoticz.Debug(f"HTTP Error on {verb} {endpoint}: {status}")
+        self.complete(status, result)
+
+    def onDisconnect(self, Connection):
+        if Connection.Name != self.name:
+            return
+        if self.current is not None:
+            Domoticz.Debug(f"Connection closed before {self.current[1]} was answered")
+            self.complete(None, None)
+        elif self.state == self.STATE_CONNECTING:
+            self.setState(self.STATE_IDLE)
+            self.failPending()
+        else:
+            self.setState(self.STATE_IDLE)
+            self.pump()
+
+    def onHeartbeat(self):
+        """Give up on a connect attempt or request that exceeded the timeout"""
+        if self.state == self.STATE_IDLE or time.time() - self.state_since < self.timeout:
+            return
+
+        if self.state == self.STATE_CLOSING:
+            # onDisconnect never arrived for the aborted connection
+            self.setState(self.STATE_IDLE)
+            self.pump()
+            return
+
+        Domoticz.Error(f"Pi-hole did not answer within {self.timeout}s")
+        request, self.current = self.current, None
+        if self.state == self.STATE_CONNECTING:
+            self.failPending()
+        self.setState(self.STATE_CLOSING)
+        if request is not None and request[3]:
+            request[3](None, None)
+        self.connection.Disconnect()
+
+    def describeStats(self):
+        average = self.latency_total / self.latency_count * 1000 if self.latency_count else 0
+        self.latency_total = 0.0
+        self.latency_count = 0
+        return (f"{self.stats['requests']} requests, {self.stats['opened']} connections opened, "
+                f"avg latency {average:.1f} ms")
+
+    def stop(self):
+        self.pending.clear()
+        self.current = None
+        if self.connection is not None and self.connection.Connected():
+            self.connection.Disconnect()
+
+
+class PiHoleSession:
+    """Tracks the Pi-hole API session (SID) and decides when it must be renewed
+
+    FTL extends a session's validity every time it is used, so the expiry is
+    measured from the last request Pi-hole accepted rather than from login.
+    """
+
+    RENEW_MARGIN = 30  # Seconds before expiry at which the session is renewed
+
+    def __init__(self):
+        self.sid = None
+        self.validity = 0
+        self.expires_at = 0
+
+    def start(self, sid, validity):
+        self.sid = sid
+        self.validity = validity
+        self.touch()
+
+    def touch(self):
+        """Record that Pi-hole accepted the session just now"""
+        if self.sid:
+            self.expires_at = time.time() + self.validity
+
+    def invalidate(self):
+        self.sid = None
+        self.expires_at = 0
+
+    def needsRenewal(self):
+        if not self.sid:
+            return True
+        margin = min(self.RENEW_MARGIN, self.validity / 2)
+        return time.time() >= self.expires_at - margin
+
+
+class PollScheduler:
+    """Keeps track of when each polling tier is due
+
+    Every tier has its own interval. A tier can be triggered on demand, which
+    makes it due on the next run regardless of its interval.
+    """
+
+    def __init__(self, intervals, tolerance=0):
+        self.intervals = dict(intervals)
+        self.tolerance = tolerance  # Run a tier slightly early rather than one heartbeat late
+        self.next_due = {tier: 0 for tier in self.intervals}
+
+    def due(self):
+        now = time.time()
+        return [tier for tier, next_due in self.next_due.items() if now + self.tolerance >= next_due]
+
+    def markRun(self, tier):
+        self.next_due[tier] = time.time() + self.intervals[tier]
+
+    def trigger(self, *tiers):
+        for tier in tiers:
+            self.next_due[tier] = 0
+
+
+class ResponseCache:
+    """Caches GET responses per endpoint for the duration of one heartbeat cycle
+
+    Every entry is stamped with the cycle generation it was fetched in and is
+    only served while that generation is current and the entry is younger than
+    ttl seconds. Writes invalidate the affected endpoint explicitly.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.generation = 0
+        self.entries = {}  # Maps endpoint -> (generation, fetched_at, result)
+        self.hits = 0
+        self.misses = 0
+
+    def newCycle(self):
+        """Start a new heartbeat cycle; everything fetched before becomes stale and is dropped"""
+        self.generation += 1
+        self.entries.clear()
+
+    def get(self, endpoint):
+        entry = self.entries.get(endpoint)
+        if entry is not None:
+            generation, fetched_at, result = entry
+            if generation == self.generation and time.time() - fetched_at <= self.ttl:
+                self.hits += 1
+                return result
+            del self.entries[endpoint]
+        self.misses += 1
+        return None
+
+    def put(self, endpoint, result):
+        self.entries[endpoint] = (self.generation, time.time(), result)
+
+    def invalidate(self, endpoint):
+        self.entries.pop(endpoint, None)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class ChangeTracker:
+    """Remembers fingerprints of API payloads so unchanged responses can be skipped
+
+    A payload fingerprint is the SHA-1 of its canonical JSON without the
+    volatile "took" field; entries of a changed payload are fingerprinted
+    individually so only the entries that differ are reprocessed. Every
+    consumer uses its own key, since the same response can feed several.
+    """
+
+    def __init__(self):
+        self.payloads = {}  # Maps key -> (payload object, fingerprint)
+        self.entries = {}   # Maps key -> {entry ID: fingerprint}
+        self.skipped = 0
+        self.reconciled = 0
+
+    @staticmethod
+    def fingerprint(data):
+        canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha1(canonical.encode()).digest()
+
+    def changed(self, key, payload):
+        """Return True when payload differs from the one last seen under key"""
+        last = self.payloads.get(key)
+        # A cached response is handed out as the same object, no need to hash it again
+        if last is not None and last[0] is payload:
+            self.skipped += 1
+            return False
+        digest = self.fingerprint({k: v for k, v in payload.items() if k != 'took'})
+        self.payloads[key] = (payload, digest)
+        if last is not None and last[1] == digest:
+            self.skipped += 1
+            return False
+        self.reconciled += 1
+        return True
+
+    def changedEntries(self, key, entries, id_field='id'):
+        """Return {entry ID: entry} for entries that are new or differ from the last call"""
+        known = self.entries.get(key, {})
+        current = {}
+        changed = {}
+        for entry in entries:
+            entry_id = entry.get(id_field)
+            digest = self.fingerprint(entry)
+            current[entry_id] = digest
+            if known.get(entry_id) != digest:
+                changed[entry_id] = entry
+        self.entries[key] = current
+        return changed
+
+    def export(self):
+        """Return the fingerprints in a JSON serialisable form"""
+        return {
+            "payloads": {key: digest.hex() for key, (payload, digest) in self.payloads.items()},
+            "entries": {key: [[entry_id, digest.hex()] for entry_id, digest in entries.items()]
+                        for key, entries in self.entries.items()},
+        }
+
+    def restore(self, data):
+        """Restore fingerprints saved by export()"""
+        self.payloads = {key: (None, bytes.fromhex(digest)) for key, digest in data.get("payloads", {}).items()}
+        self.entries = {key: {entry_id: bytes.fromhex(digest) for entry_id, digest in entries}
+                        for key, entries in data.get("entries", {}).items()}
+
+    def forget(self, key=None):
+        """Drop the fingerprints of key, or all of them, so the next payload is processed in full"""
+        if key is None:
+            self.payloads.clear()
+            self.entries.clear()
+        else:
+            self.payloads.pop(key, None)
+            self.entries.pop(key, None)
+
+
+class RollingCounter:
+    """Event count over a sliding window, kept in a fixed ring of time buckets"""
+
+    def __init__(self, buckets, width=60):
+        self.width = width
+        self.counts = [0] * buckets
+        self.slots = [-1] * buckets  # Bucket number each slot currently holds
+
+    def add(self, timestamp, count=1):
+        bucket = int(timestamp // self.width)
+        i = bucket % len(self.counts)
+        if self.slots[i] != bucket:
+            if self.slots[i] > bucket:
+                return  # Older than the window
+            self.slots[i] = bucket
+            self.counts[i] = 0
+        self.counts[i] += count
+
+    def total(self, now):
+        current = int(now // self.width)
+        oldest = current - len(self.counts) + 1
+        return sum(count for count, bucket in zip(self.counts, self.slots) if oldest <= bucket <= current)
+
+
+class RateRollup:
+    """Ring buffer of timestamped counter samples for deriving rates
+
+    Pi-hole's counters restart at midnight; samples are stored as running
+    totals that keep increasing across such resets. Every window has a cursor
+    on the newest sample at least window seconds old, which only moves forward,
+    so adding a sample and reading a rate cost O(1) amortised.
+    """
+
+    def __init__(self, capacity, metrics):
+        self.capacity = max(2, capacity)
+        self.metrics = metrics
+        self.times = array.array('d', [0.0]) * self.capacity
+        self.totals = {metric: array.array('d', [0.0]) * self.capacity for metric in metrics}
+        self.last_raw = {}
+        self.count = 0  # Samples added so far; sample n lives in slot n % capacity
+        self.cursors = {}  # Maps window -> sample number of its base sample
+
+    def add(self, timestamp, values):
+        slot = self.count % self.capacity
+        previous = (self.count - 1) % self.capacity
+        self.times[slot] = timestamp
+        for metric in self.metrics:
+            raw = values.get(metric, 0)
+            last = self.last_raw.get(metric)
+            if last is None:
+                delta = 0
+            elif raw < last:
+                delta = raw  # Counter was reset, everything since counts
+            else:
+                delta = raw - last
+            self.last_raw[metric] = raw
+            self.totals[metric][slot] = (self.totals[metric][previous] if self.count else 0) + delta
+        self.count += 1
+
+    def rate(self, metric, window, per=60):
+        """Return the rate per `per` seconds over the last window seconds, None without two samples"""
+        if self.count < 2:
+            return None
+        latest = self.count - 1
+        oldest = max(0, self.count - self.capacity)
+        now = self.times[latest % self.capacity]
+        
+        base = max(self.cursors.get(window, oldest), oldest)
+        while base + 1 < latest and self.times[(base + 1) % self.capacity] <= now - window:
+            base += 1
+        self.cursors[window] = base
+        
+        elapsed = now - self.times[base % self.capacity]
+        if elapsed <= 0:
+            return None
+        totals = self.totals[metric]
+        return (totals[latest % self.capacity] - totals[base % self.capacity]) * per / elapsed
+
+
+class QueryIngester:
+    """Folds new rows of Pi-hole's query log into rolling counters per watched client and domain
+
+    Only watched clients and domains are counted, each in a fixed ring of
+    one-minute buckets, so memory does not grow with the query volume. The
+    time and ID of the newest row counted make every scan ask only for rows
+    that were not counted yet. Pi-hole returns the newest rows first, so a scan
+    pages backwards, pinned to Pi-hole's cursor, until it reaches a row already
+    counted. A scan longer than PAGES_PER_CYCLE pages of page_size rows is
+    continued in the next cycle at the oldest row not read yet.
+    """
+
+    BUCKET_SECONDS = 60
+    PAGES_PER_CYCLE = 5
+
+    def __init__(self, clients, domains, window_minutes, page_size):
+        self.window = window_minutes * self.BUCKET_SECONDS
+        self.page_size = page_size
+        self.clients = {client: f"client:{client}" for client in clients}
+        self.domains = {domain: f"domain:{domain}" for domain in domains}
+        self.counters = {key: RollingCounter(window_minutes, self.BUCKET_SECONDS)
+                         for key in list(self.clients.values()) + list(self.domains.values())}
+        self.last_time = None
+        self.last_id = -1
+        self.scan = None  # [since, cursor, start, newest ID, newest time] of the scan in progress
+        self.ingested = 0
+        self.deferred = 0  # Cycles that left the rest of their scan to the next cycle
+
+    def endpoint(self, now):
+        if self.scan:
+            since, cursor, start = self.scan[:3]
+            return f"/queries?from={int(since)}&length={self.page_size}&cursor={cursor}&start={start}"
+        since = now - self.window
+        if self.last_time is not None:
+            since = max(since, self.last_time)
+        self.scan = [since, None, 0, self.last_id, self.last_time]
+        return f"/queries?from={int(since)}&length={self.page_size}"
+
+    def ingest(self, result):
+        """Count the rows of one page newer than the last scan; returns the number of new rows
+        Afterwards self.scan is None when the scan is complete, otherwise the next page is due.
+        """
+        rows = result['queries']
+        scan = self.scan
+        if scan[1] is None:
+            scan[1] = result.get('cursor')
+        new = 0
+        reached = False
+        for row in rows:
+            query_id = row.get('id', 0)
+            if query_id <= self.last_id:
+                reached = True
+                continue
+            new += 1
+            timestamp = row.get('time', 0)
+            if query_id > scan[3]:
+                scan[3], scan[4] = query_id, timestamp
+            for key in self.match(row):
+                self.counters[key].add(timestamp)
+        scan[2] += len(rows)
+        if reached or len(rows) < self.page_size or scan[1] is None:
+            # Everything since the last scan has been counted
+            self.last_id, self.last_time = scan[3], scan[4]
+            self.scan = None
+        self.ingested += new
+        return new
+
+    def match(self, row):
+        """Yield the counter keys a query log row belongs to"""
+        client = row.get('client') or {}
+        for value in {client.get('ip'), client.get('name')}:
+            if value in self.clients:
+                yield self.clients[value]
+        
+        # A watched domain also counts its subdomains
+        labels = (row.get('domain') or '').lower().split('.')
+        for i in range(len(labels)):
+            key = self.domains.get('.'.join(labels[i:]))
+            if key:
+                yield key
+
+    def totals(self, now):
+        return {key: counter.total(now) for key, counter in self.counters.items()}
+
+
+class CircuitBreaker:
+    """Stops sending requests to a Pi-hole that keeps failing
+
+    closed: requests flow normally; threshold consecutive failures open the circuit.
+    open: requests fail at once until the backoff has passed; the backoff doubles
+    with every failed probe up to max_backoff and is jittered so several plugin
+    instances do not probe in lockstep.
+    half-open: a single probe request is in flight; its outcome closes or reopens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold=3, backoff=10, max_backoff=300):
+        self.threshold = max(1, threshold)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0  # Consecutive times the circuit opened without recovering
+        self.retry_at = 0
+
+    def isClosed(self):
+        return self.state == self.CLOSED
+
+    def probeDue(self):
+        """Return True, and go half-open, when the open circuit may send its probe"""
+        if self.state == self.OPEN and time.time() >= self.retry_at:
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def recordSuccess(self):
+        """Return True when this success closed an open circuit"""
+        recovered = self.state != self.CLOSED
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        return recovered
+
+    def recordFailure(self):
+        """Return the backoff in seconds when this failure opened the circuit, else None"""
+        self.failures += 1
+        if self.state == self.OPEN:
+            return None
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            self.opened += 1
+            delay = min(self.max_backoff, self.backoff * 2 ** (self.opened - 1))
+            delay = random.uniform(delay / 2, delay)
+            self.state = self.OPEN
+            self.retry_at = time.time() + delay
+            return delay
+        return None
+
+
+class StateSnapshot:
+    """Keeps the plugin state in a small JSON file so a restart needs no network round trip
+
+    The file is written to a temporary name and moved into place, so a crash
+    while saving leaves the previous snapshot intact.
+    """
+
+    VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            Domoticz.Error(f"Cannot read state snapshot {self.path}: {e}")
+            return None
+        if data.get("version") != self.VERSION:
+            Domoticz.Log(f"Ignoring state snapshot of version {data.get('version')}")
+            return None
+        return data
+
+    def save(self, data):
+        data = dict(data, version=self.VERSION)
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            Domoticz.Error(f"Cannot write state snapshot {self.path}: {e}")
+            return False
+        return True
+
+
+class CommandQueue:
+    """Collects list/group commands until no new one arrived for window seconds
+
+    Commands are keyed by entity, so a later toggle of the same list or group
+    replaces the earlier one (last write wins).
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.pending = {}  # Maps (kind, entity ID) -> command tuple
+        self.received = 0
+        self.first_at = None
+        self.last_at = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, key, command):
+        now = time.time()
+        if not self.pending:
+            self.first_at = now
+        self.last_at = now
+        self.received += 1
+        self.pending.pop(key, None)  # Re-insert so the batch keeps the order of the last commands
+        self.pending[key] = command
+
+    def get(self, key):
+        return self.pending.get(key)
+
+    def due(self):
+        return bool(self.pending) and time.time() - self.last_at >= self.window
+
+    def take(self):
+        """Return (commands, received count, first command time) and empty the queue"""
+        batch = (list(self.pending.values()), self.received, self.first_at)
+        self.pending = {}
+        self.received = 0
+        self.first_at = self.last_at = None
+        return batch
+
+
+class ScheduleTimeline:
+    """Weekly on/off windows for lists and groups, compiled into a sorted transition timeline
+
+    Every rule line reads "<kind> <ID or name>: <on|off> <days> <HH:MM-HH:MM> ...",
+    e.g. "group Kids: off Mon-Fri 21:00-07:00". Inside its windows an entity
+    has the given state and outside all of them the opposite one; a window
+    whose end is not after its start runs into the next day. The windows are
+    compiled once into (minute of the week, key, state) transitions sorted by
+    time, so the next transition is found with a bisect and a heartbeat in
+    between costs a single comparison.
+    """
+
+    DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+    WEEK = 7 * 24 * 60  # Minutes
+
+    def __init__(self):
+        self.rules = {}      # Maps (kind, reference) -> (state, [(start, end) minutes of the week])
+        self.timeline = []   # Sorted (minute of the week, key, state) transitions
+        self.minutes = []    # Minute of every transition, for bisect
+        self.checked_at = None
+        self.next_at = 0
+
+    def __len__(self):
+        return len(self.rules)
+
+    def parse(self, text):
+        """Add the rules of a schedule file; returns the lines that could not be read"""
+        errors = []
+        for number, line in enumerate(text.splitlines(), 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            try:
+                self.addRule(line)
+            except ValueError as e:
+                errors.append(f"line {number}: {e}")
+        self.compile()
+        return errors
+
+    def addRule(self, line):
+        target, separator, spec = line.partition(':')
+        kind, _, reference = target.strip().partition(' ')
+        words = spec.split()
+        if not separator or not reference.strip() or len(words) < 3:
+            raise ValueError(f"expected '<kind> <ID or name>: <on|off> <days> <HH:MM-HH:MM>', got '{line}'")
+        if words[0].lower() not in ("on", "off"):
+            raise ValueError(f"state must be on or off, got '{words[0]}'")
+        state = words[0].lower() == "on"
+        key = (kind.lower(), reference.strip())
+        windows = [(day * 1440 + start, day * 1440 + end + (1440 if end <= start else 0))
+                   for day in self.parseDays(words[1]) for start, end in map(self.parseWindow, words[2:])]
+        previous = self.rules.get(key)
+        if previous and previous[0] != state:
+            raise ValueError(f"{kind} {reference.strip()} already has windows switching it {'on' if previous[0] else 'off'}")
+        self.rules[key] = (state, (previous[1] if previous else []) + windows)
+
+    def parseDays(self, text):
+        if text.lower() in ("daily", "*"):
+            return range(7)
+        days = []
+        for part in text.lower().split(','):
+            first, _, last = part.partition('-')
+            if first[:3] not in self.DAYS or (last and last[:3] not in self.DAYS):
+                raise ValueError(f"unknown days '{part}'")
+            start = self.DAYS.index(first[:3])
+            end = self.DAYS.index(last[:3]) if last else start
+            days.extend((start + offset) % 7 for offset in range((end - start) % 7 + 1))
+        return days
+
+    def parseWindow(self, text):
+        try:
+            start, end = ([int(value) for value in part.split(':')] for part in text.split('-'))
+            start, end = start[0] * 60 + start[1], end[0] * 60 + end[1]
+        except (ValueError, IndexError):
+            start = end = -1
+        if not (0 <= start < 1440 and 0 <= end <= 1440):
+            raise ValueError(f"window must be HH:MM-HH:MM, got '{text}'")
+        return start, end
+
+    def compile(self):
+        """Turn the windows into the transitions where the state of an entity actually flips"""
+        timeline = []
+        for key in self.rules:
+            bounds = {minute % self.WEEK for window in self.rules[key][1] for minute in window}
+            for minute in bounds:
+                state = self.stateAt(key, minute)
+                if state != self.stateAt(key, (minute - 1) % self.WEEK):
+                    timeline.append((minute, key, state))
+        self.timeline = sorted(timeline)
+        self.minutes = [minute for minute, key, state in self.timeline]
+
+    def stateAt(self, key, minute):
+        state, windows = self.rules[key]
+        for start, end in windows:
+            # Windows may run past the end of the week into Monday
+            if start <= minute < end or start <= minute + self.WEEK < end:
+                return state
+        return not state
+
+    def weekMinute(self, now):
+        local = time.localtime(now)
+        return local.tm_wday * 1440 + local.tm_hour * 60 + local.tm_min
+
+    def desired(self, now):
+        """Return {key: state} of every rule at time now"""
+        minute = self.weekMinute(now)
+        self.advance(now, minute)
+        return {key: self.stateAt(key, minute) for key in self.rules}
+
+    def due(self, now):
+        """Return {key: state} of the transitions passed since the previous call, the last one per key"""
+        if now < self.next_at:
+            return {}
+        minute = self.weekMinute(now)
+        if self.checked_at is None or now - self.checked_at >= self.WEEK * 60:
+            return self.desired(now)
+        last = self.weekMinute(self.checked_at)
+        first_index = bisect.bisect_right(self.minutes, last)
+        last_index = bisect.bisect_right(self.minutes, minute)
+        if minute >= last:
+            passed = self.timeline[first_index:last_index]
+        else:
+            passed = self.timeline[first_index:] + self.timeline[:last_index]
+        self.advance(now, minute)
+        return {key: state for _, key, state in passed}
+
+    def advance(self, now, minute):
+        """Remember the time of this check and when the next transition falls due"""
+        self.checked_at = now
+        if not self.timeline:
+            self.next_at = float('inf')
+            return
+        index = bisect.bisect_right(self.minutes, minute)
+        wait = (self.minutes[index % len(self.minutes)] - minute) % self.WEEK or self.WEEK
+        self.next_at = now - now % 60 + wait * 60
+
+
+class DeviceWriter:
+    """Single path for all Domoticz device writes
+
+    Every write is a database update that also fires Domoticz events, so the
+    writer keeps a shadow copy of what each device holds, drops writes that
+    would not change it and merges updates of the same unit within a batch
+    into one. Throttled units are only written every Nth change, or earlier
+    when the value moved by at least threshold percent since the last write.
+    """
+
+    def __init__(self, devices, every=1, threshold=0.0, throttled=()):
+        self.devices = devices
+        self.every = max(1, every)
+        self.threshold = threshold
+        self.throttled = set(throttled)
+        self.shadow = {}   # Maps unit -> [nValue, sValue, Name] as last written
+        self.pending = {}  # Maps unit -> fields to write when the batch ends
+        self.held = {}     # Maps throttled unit -> changes not written yet
+        self.depth = 0
+        self.writes = 0
+        self.merged = 0
+        self.unchanged = 0
+        self.skipped = 0   # Changes of throttled units that were not written
+        self.last_writes = 0
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Collect the updates of a plugin callback and write them once it returns"""
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if not self.depth:
+                self.flush()
+
+    def update(self, unit, nValue=None, sValue=None, name=None):
+        """Queue new values for a device; None keeps the current value"""
+        if unit not in self.devices:
+            return
+        fields = self.pending.get(unit)
+        if fields is None:
+            fields = self.pending[unit] = {}
+        else:
+            self.merged += 1
+        for index, value in enumerate((nValue, sValue, name)):
+            if value is not None:
+                fields[index] = value
+        if not self.depth:
+            self.flush()
+
+    def current(self, unit):
+        """Return [nValue, sValue, Name] of a device including the updates queued in this batch"""
+        if unit not in self.devices:
+            return None
+        device = self.devices[unit]
+        values = list(self.shadow.get(unit) or (device.nValue, device.sValue, device.Name))
+        for index, value in self.pending.get(unit, {}).items():
+            values[index] = value
+        return values
+
+    def forget(self, unit):
+        """Drop the shadow of a deleted device"""
+        self.shadow.pop(unit, None)
+        self.pending.pop(unit, None)
+        self.held.pop(unit, None)
+
+    def flush(self, force=False):
+        """Write the pending updates that change a device; force also writes held back values"""
+        pending, self.pending = self.pending, {}
+        if force:
+            for unit, (changes, values) in self.held.items():
+                pending[unit] = {**dict(enumerate(values)), **pending.get(unit, {})}
+            self.held.clear()
+        
+        writes = 0
+        for unit, fields in pending.items():
+            if unit not in self.devices:
+                continue
+            device = self.devices[unit]
+            current = self.shadow.get(unit)
+            if current is None:
+                current = self.shadow[unit] = [device.nValue, device.sValue, device.Name]
+            values = [fields.get(index, current[index]) for index in range(3)]
+            if values == current:
+                self.held.pop(unit, None)
+                self.unchanged += 1
+                continue
+            # Renames are never held back, only value changes of throttled counters
+            throttle = unit in self.throttled and not force and values[2] == current[2]
+            if throttle and not self.due(unit, current, values):
+                self.skipped += 1
+                continue
+            self.held.pop(unit, None)
+            if values[2] != current[2]:
+                device.Update(nValue=values[0], sValue=values[1], Name=values[2])
+            else:
+                device.Update(nValue=values[0], sValue=values[1])
+            self.shadow[unit] = values
+            writes += 1
+        
+        self.writes += writes
+        self.last_writes = writes
+        return writes
+
+    def due(self, unit, current, values):
+        """Count a change of a throttled unit and tell whether it has to be written now"""
+        changes = self.held.get(unit, (0, None))[0] + 1
+        self.held[unit] = (changes, values)
+        if changes >= self.every:
+            return True
+        try:
+            written, value = float(current[1]), float(values[1])
+        except ValueError:
+            return True
+        if not written or value < written:  # First value or a counter reset
+            return True
+        return bool(self.threshold) and (value - written) * 100 / written >= self.threshold
+
+    def describeStats(self):
+        return (f"{self.writes} writes ({self.last_writes} last batch), {self.merged} merged, "
+                f"{self.unchanged} unchanged, {self.skipped} throttled")
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of durations in milliseconds
+
+    Percentiles are reported as the upper bound of the bucket they fall in,
+    which is precise enough to tell a 20 ms Pi-hole from a 2 s one while using
+    a constant amount of memory however many samples are added.
+    """
+
+    BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)  # Upper bounds, plus one overflow bucket
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(self.BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def describe(self):
+        return (f"n={self.count}, p50 {self.percentile(50):.0f} ms, p95 {self.percentile(95):.0f} ms, "
+                f"max {self.max:.0f} ms")
+
+
+class Instrumentation:
+    """Timings and volumes of the plugin's hot paths, collected per publishing window
+
+    Transports report every request from whichever thread executed it, the
+    plugin reports its callback durations and device writes. take() hands out
+    the current window and starts a new one.
+    """
+
+    FIELDS = ('start', 'endpoints', 'requests', 'callbacks', 'bytes_received', 'parse_seconds', 'writes')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.start = time.time()
+        self.endpoints = collections.defaultdict(LatencyHistogram)  # "GET /lists" -> request latencies
+        self.requests = LatencyHistogram()                          # All requests together
+        self.callbacks = collections.defaultdict(LatencyHistogram)  # "heartbeat" -> durations
+        self.bytes_received = 0
+        self.parse_seconds = 0.0
+        self.writes = 0
+
+    def request(self, verb, endpoint, seconds, size, parse_seconds):
+        # Items in the path (list addresses, group names) would make a histogram per item
+        path = endpoint.partition('?')[0]
+        if verb != "GET" and path.count('/') > 1:
+            path = path[:path.index('/', 1)] + "/*"
+        with self.lock:
+            self.endpoints[f"{verb} {path}"].add(seconds * 1000)
+            self.requests.add(seconds * 1000)
+            self.bytes_received += size
+            self.parse_seconds += parse_seconds
+
+    def callback(self, name, seconds, writes):
+        with self.lock:
+            self.callbacks[name].add(seconds * 1000)
+            self.writes += writes
+
+    def take(self):
+        """Return the metrics collected since the last call and start a new window"""
+        window = Instrumentation()
+        with self.lock:
+            for field in self.FIELDS:
+                setattr(window, field, getattr(self, field))
+            self.reset()
+        return window
+
+    def describe(self):
+        lines = [f"{name}: {histogram.describe()}" for name, histogram in sorted(self.endpoints.items())]
+        lines += [f"on{name.capitalize()}: {histogram.describe()}" for name, histogram in sorted(self.callbacks.items())]
+        lines.append(f"{self.bytes_received / 1024:.1f} kB received, JSON parsing {self.parse_seconds * 1000:.1f} ms, "
+                     f"{self.writes} device writes in {time.time() - self.start:.0f}s")
+        return "; ".join(lines)
+
+
+class HeartbeatProfiler:
+    """Profiles heartbeats with cProfile and writes the stats to rotating .pstats files
+
+    Every `every` heartbeats the collected profile is written to
+    <prefix>_<n>.pstats, n cycling through 0..keep-1, and a new profile starts.
+    The files can be inspected with python3 -m pstats.
+    """
+
+    def __init__(self, prefix, every=60, keep=5):
+        self.prefix = prefix
+        self.every = every
+        self.keep = keep
+        self.profile = cProfile.Profile()
+        self.runs = 0
+        self.dumps = 0
+
+    @contextlib.contextmanager
+    def run(self):
+        self.profile.enable()
+        try:
+            yield
+        finally:
+            self.profile.disable()
+            self.runs += 1
+            if self.runs >= self.every:
+                self.dump()
+
+    def dump(self):
+        """Write the profile collected so far, if any, and start a new one"""
+        if not self.runs:
+            return None
+        path = f"{self.prefix}_{self.dumps % self.keep}.pstats"
+        try:
+            self.profile.dump_stats(path)
+        except OSError as e:
+            Domoticz.Error(f"Could not write profile {path}: {e}")
+            path = None
+        self.dumps += 1
+        self.runs = 0
+        self.profile = cProfile.Profile()
+        return path
+
+
+class EntityRecord:
+    """Compact projection of a Pi-hole entity holding only the fields the plugin uses"""
+
+    __slots__ = ('id', 'address', 'type', 'name', 'comment', 'groups', 'enabled')
+
+    def __init__(self, entity_id, address, entity_type, name, comment, groups, enabled):
+        self.id = entity_id
+        self.address = address
+        self.type = entity_type
+        self.name = name
+        self.comment = comment
+        self.groups = groups
+        self.enabled = enabled
+
+    def toSnapshot(self):
+        return [getattr(self, field) for field in self.__slots__]
+
+    @classmethod
+    def fromSnapshot(cls, values):
+        record = cls(*values)
+        record.groups = tuple(record.groups)
+        return record
+
+    @classmethod
+    def fromList(cls, lst):
+        return cls(lst.get('id'), lst.get('address', ''), lst.get('type', 'block'),
+                   lst.get('comment', 'Unnamed List'), lst.get('comment'), tuple(lst.get('groups', ())),
+                   bool(lst.get('enabled', False)))
+
+    @classmethod
+    def fromGroup(cls, grp):
+        return cls(grp.get('id'), None, None, grp.get('name'), grp.get('comment'), (),
+                   bool(grp.get('enabled', True)))
+
+    @classmethod
+    def fromDomain(cls, dom):
+        return cls(dom.get('id'), dom.get('domain'), f"{dom.get('type', 'deny')}/{dom.get('kind', 'exact')}",
+                   dom.get('domain'), dom.get('comment'), tuple(dom.get('groups', ())),
+                   bool(dom.get('enabled', True)))
+
+    @classmethod
+    def fromClientGroup(cls, entry):
+        # type holds the group ID whose membership the record represents
+        return cls(entry['id'], entry['client'], entry['group'], entry.get('name'), entry.get('comment'),
+                   tuple(entry['groups']), entry['enabled'])
+
+
+class EntitySpec:
+    """Declarative description of a Pi-hole entity type mirrored as Domoticz switches
+
+    endpoint and collection name the GET request and the array in its response;
+    entries(payload) yields the entry dicts (each with an "id") to mirror,
+    record(entry) projects one into an EntityRecord, name(record) gives its
+    device name and update(record, enabled) the (endpoint, body) of the PUT
+    that switches it, or None when it cannot be switched. The device
+    Description is prefix + entity ID. fields lists the entry fields record()
+    and entries() read; the rest is dropped while the response is parsed.
+    """
+
+    def __init__(self, kind, label, endpoint, collection, prefix, record, name, update,
+                 entries=None, parse_id=int, fields=None):
+        self.kind = kind
+        self.label = label
+        self.endpoint = endpoint
+        self.collection = collection
+        self.prefix = prefix
+        self.record = record
+        self.name = name
+        self.update = update
+        self.entries = entries or (lambda payload: payload[collection])
+        self.parse_id = parse_id
+        self.fields = fields
+        self.registry = UnitRegistry([])
+
+
+class UnitRegistry:
+    """Bidirectional Pi-hole entity ID <-> Domoticz unit index with a free-unit allocator
+
+    Units are allocated lowest-first from one or more configured ranges. The free
+    units are kept in a heap; units that turn out to be in use when popped are
+    skipped, so loading existing devices does not have to touch the heap.
+    """
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+        self.unit_by_id = {}
+        self.id_by_unit = {}
+        self.records = {}  # Maps entity ID -> EntityRecord from the last Pi-hole response
+        self.free = [unit for first, last in ranges for unit in range(first, last + 1)]
+        heapq.heapify(self.free)
+
+    def __contains__(self, entity_id):
+        return entity_id in self.unit_by_id
+
+    def __len__(self):
+        return len(self.unit_by_id)
+
+    def ids(self):
+        return self.unit_by_id.keys()
+
+    def unitFor(self, entity_id):
+        return self.unit_by_id.get(entity_id)
+
+    def idFor(self, unit):
+        return self.id_by_unit.get(unit)
+
+    def add(self, entity_id, unit):
+        """Register an existing device"""
+        self.unit_by_id[entity_id] = unit
+        self.id_by_unit[unit] = entity_id
+
+    def allocate(self, entity_id, in_use):
+        """Assign the lowest free unit for which in_use(unit) is false; None when exhausted"""
+        while self.free:
+            unit = heapq.heappop(self.free)
+            if unit not in self.id_by_unit and not in_use(unit):
+                self.add(entity_id, unit)
+                return unit
+        return None
+
+    def release(self, entity_id):
+        """Forget an entity and return its unit to the free pool"""
+        self.records.pop(entity_id, None)
+        unit = self.unit_by_id.pop(entity_id, None)
+        if unit is not None:
+            del self.id_by_unit[unit]
+            if any(first <= unit <= last for first, last in self.ranges):
+                heapq.heappush(self.free, unit)
+        return unit
+
+    def capacity(self):
+        return sum(last - first + 1 for first, last in self.ranges)
+
+
+ApiResult = collections.namedtuple('ApiResult', ['verb', 'endpoint', 'status', 'result', 'callback'])
+
+
+class WorkerTransport:
+    """Runs Pi-hole API requests on a background thread owned by the plugin
+
+    The plugin thread only enqueues requests. The worker performs the HTTP
+    exchange and JSON decoding and posts an ApiResult to a result queue, which
+    is drained on the plugin thread at every heartbeat: Domoticz devices must
+    never be touched from any other thread.
+    """
+
+    STOP_TIMEOUT = 3  # Seconds onStop waits for the worker to finish
+
+    def __init__(self, base_url, sid_provider, timeout=5, workers=1, deadline=None, metrics=None,
+                 projections=None):
+        self.client = BlockingTransport(base_url, sid_provider, timeout, workers, deadline, metrics, projections)
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.outstanding = 0
+        self.batched = None
+        self.thread = threading.Thread(target=self.run, name="PiHoleWorker", daemon=True)
+        self.thread.start()
+
+    def request(self, verb, endpoint, data=None, callback=None, authenticated=True):
+        """Queue a request; callback(status, result) runs on the plugin thread when drained"""
+        self.outstanding += 1
+        if self.batched is not None:
+            self.batched.append((verb, endpoint, data, callback, authenticated))
+        else:
+            self.requests.put([(verb, endpoint, data, callback, authenticated)])
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Hand the requests made inside the block to the worker as one concurrent batch
+        A nested batch joins the one already collecting.
+        """
+        if self.batched is not None:
+            yield
+            return
+        self.batched = []
+        try:
+            yield
+        finally:
+            requests, self.batched = self.batched, None
+            if requests:
+                self.requests.put(requests)
+
+    def run(self):
+        while True:
+            requests = self.requests.get()
+            if requests is None:
+                break
+            for request, status, result in self.client.executeMany(requests):
+                self.results.put(ApiResult(request[0], request[1], status, result, request[3]))
+        self.client.stop()
+
+    def drain(self):
+        """Run the callbacks of all finished requests on the plugin thread"""
+        while True:
+            try:
+                item = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.outstanding -= 1
+            if item.callback:
+                item.callback(item.status, item.result)
+
+    def isBusy(self):
+        return self.outstanding > 0
+
+    def describeStats(self):
+        return self.client.describeStats()
+
+    def onConnect(self, Connection, Status, Description):
+        pass
+
+    def onMessage(self, Connection, Data):
+        pass
+
+    def onDisconnect(self, Connection):
+        pass
+
+    def onHeartbeat(self):
+        self.drain()
+
+    def stop(self):
+        # Drop work that has not started yet, then let the worker finish its current batch
+        while True:
+            try:
+                self.requests.get_nowait()
+            except queue.Empty:
+                break
+        self.requests.put(None)
+        self.thread.join(self.STOP_TIMEOUT)
+        if self.thread.is_alive():
+            Domoticz.Error(f"Pi-hole worker thread did not stop within {self.STOP_TIMEOUT}s")
+
+
+class TransportGroup:
+    """Drives the transports of several Pi-holes as one
+
+    Requests are sent through the transport of their target; the group only
+    fans out the Domoticz callbacks and batches. Batches of blocking transports
+    are executed concurrently, one thread per Pi-hole, so polling two Pi-holes
+    takes as long as the slower of them.
+    """
+
+    def __init__(self, transports):
+        self.transports = transports
+        self.executor = None
+        self.collecting = False  # A nested batch joins the one collecting
+
+    @contextlib.contextmanager
+    def batch(self):
+        if self.collecting:
+            yield
+            return
+        blocking = [t for t in self.transports if isinstance(t, BlockingTransport)]
+        if len(blocking) <= 1:
+            with contextlib.ExitStack() as stack:
+                for transport in self.transports:
+                    stack.enter_context(transport.batch())
+                yield
+            return
+        
+        with contextlib.ExitStack() as stack:
+            for transport in self.transports:
+                if transport not in blocking:
+                    stack.enter_context(transport.batch())
+            for transport in blocking:
+                transport.batched = []
+            self.collecting = True
+            try:
+                yield
+            finally:
+                self.collecting = False
+                batches = [(transport, transport.batched) for transport in blocking]
+                for transport in blocking:
+                    transport.batched = None
+            
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(blocking),
+                                                                      thread_name_prefix="PiHoleTarget")
+            futures = [self.executor.submit(transport.executeMany, requests)
+                       for transport, requests in batches if requests]
+            # Callbacks touch devices, so they run here on the plugin thread
+            for future in futures:
+                for request, status, result in future.result():
+                    if request[3]:
+                        request[3](status, result)
+
+    def isBusy(self):
+        return any(transport.isBusy() for transport in self.transports)
+
+    def describeStats(self):
+        return "; ".join(transport.describeStats() for transport in self.transports)
+
+    def onConnect(self, Connection, Status, Description):
+        for transport in self.transports:
+            transport.onConnect(Connection, Status, Description)
+
+    def onMessage(self, Connection, Data):
+        for transport in self.transports:
+            transport.onMessage(Connection, Data)
+
+    def onDisconnect(self, Connection):
+        for transport in self.transports:
+            transport.onDisconnect(Connection)
+
+    def onHeartbeat(self):
+        for transport in self.transports:
+            transport.onHeartbeat()
+
+    def stop(self):
+        for transport in self.transports:
+            transport.stop()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class PiHoleTarget:
+    """One Pi-hole the plugin talks to, with its own session, transport and circuit breaker"""
+
+    def __init__(self, index, address, password):
+        self.index = index
+        self.address = address.rstrip('/')
+        self.password = password
+        self.session = PiHoleSession()
+        self.auth_waiters = []  # Callbacks waiting for the authentication in flight
+        self.transport = None
+        self.breaker = CircuitBreaker()
+
+    def getSid(self):
+        return self.session.sid
+
+
+class GravityRunner:
+    """Runs a gravity rebuild on one Pi-hole from a background thread
+
+    POST /api/action/gravity answers with a chunked plain text stream of
+    progress lines that only ends when the rebuild has finished, which can take
+    minutes. The thread reads it line by line and queues every line; the plugin
+    thread collects them with poll(), so the output is never buffered as a whole
+    and the plugin thread never waits for it.
+    """
+
+    ESCAPES = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+    TIMEOUT = 600
+
+    def __init__(self, base_url, sid):
+        self.pool = HttpConnectionPool(base_url, timeout=self.TIMEOUT)
+        self.sid = sid
+        self.lines = queue.Queue()
+        self.result = None  # (success, last line or error) once the stream has ended
+        self.thread = threading.Thread(target=self.run, name="PiHoleGravity", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        conn = self.pool.newConnection()
+        last = ""
+        try:
+            conn.request("POST", self.pool.path_prefix + "/api/action/gravity",
+                         headers={"X-FTL-SID": self.sid, "Accept": "text/plain"})
+            response = conn.getresponse()
+            if response.status >= 400:
+                self.result = (False, f"HTTP {response.status} {response.reason}")
+                return
+            while True:
+                line = response.readline()
+                if not line:
+                    break
+                text = self.clean(line.decode('utf-8', 'replace'))
+                if text:
+                    last = text
+                    self.lines.put(text)
+            self.result = (True, last)
+        except Exception as e:
+            self.result = (False, str(e) or e.__class__.__name__)
+        finally:
+            conn.close()
+
+    def clean(self, line):
+        """Strip terminal escapes; of a line redrawn with carriage returns keep the final text"""
+        parts = [part.strip() for part in self.ESCAPES.sub('', line).split('\r')]
+        return next((part for part in reversed(parts) if part), '')
+
+    def poll(self):
+        """Return the lines received since the last call"""
+        lines = []
+        while True:
+            try:
+                lines.append(self.lines.get_nowait())
+            except queue.Empty:
+                return lines
+
+    def isDone(self):
+        return self.result is not None and self.lines.empty()
+
+
+def decodeJson(raw, fields=None):
+    """Decode a JSON response body; empty bodies decode to None
+    With fields, every object with an "id" (the entries of a collection) is cut down
+    to those fields as soon as the parser has built it, so the full entries never
+    pile up in memory.
+    """
+    if not raw:
+        return None
+    if isinstance(raw, bytes):
+        raw = raw.decode('utf-8')
+    if not fields:
+        return json.loads(raw)
+    
+    def project(entry):
+        if 'id' not in entry:
+            return entry
+        return {field: entry[field] for field in fields if field in entry}
+    return json.loads(raw, object_hook=project)
+
 
 class PiHolePlugin:
     
@@ -51,14 +1844,100 @@ class PiHolePlugin:
     UNIT_UNIQUE_CLIENTS = 8
     UNIT_UNIQUE_DOMAINS = 9
     UNIT_STATUS = 10
-    UNIT_LISTS_START = 100   # Lists start from unit 100
-    UNIT_GROUPS_START = 200  # Groups start from unit 200
+    UNIT_QUERIES_PER_MINUTE = 11
+    UNIT_BLOCKED_PER_MINUTE = 12
+    UNIT_QUERIES_PER_HOUR = 13
+    UNIT_BLOCKED_PER_HOUR = 14
+    UNIT_BLOCKING = 20       # Selector driving /dns/blocking
+    UNIT_BLOCKING_TIMER = 21
+    UNIT_GRAVITY_BUTTON = 22  # Push button starting a gravity rebuild
+    UNIT_GRAVITY_STATUS = 23
+    UNIT_API_LATENCY_P50 = 30  # Optional instrumentation devices 30-36
+    UNIT_API_LATENCY_P95 = 31
+    UNIT_API_LATENCY_MAX = 32
+    UNIT_HEARTBEAT_TIME = 33
+    UNIT_KB_RECEIVED = 34
+    UNIT_JSON_PARSE_TIME = 35
+    UNIT_DEVICE_WRITES = 36
+    UNIT_WATCH_START = 40    # Watched client/domain query counters 40-69
+    UNIT_WATCH_END = 69
+    UNIT_ENTITIES_START = 70  # Lists, groups, domains and clients use units 70-255
+    UNIT_MAX = 255           # Highest unit number Domoticz allows for a plugin device
+    
+    # Blocking selector levels -> seconds blocking stays disabled (None = until switched back)
+    BLOCKING_LEVELS = {0: 0, 10: 300, 20: 1800, 30: 3600, 40: None}
+    
+    # Counters that change on nearly every poll, written according to stats_every/stats_threshold
+    THROTTLED_UNITS = (UNIT_DNS_QUERIES, UNIT_ADS_BLOCKED, UNIT_QUERIES_FORWARDED, UNIT_QUERIES_CACHED)
+    
+    # Polling tiers: statistics, list/group enabled states, structural add/remove/rename sync
+    TIER_STATS = "stats"
+    TIER_STATE = "state"
+    TIER_SYNC = "sync"
+    DEFAULT_SYNC_INTERVAL = 600
+    MAX_HEARTBEAT = 30  # Domoticz warns about plugins with a longer heartbeat
+    WORKER_HEARTBEAT = 5  # Worker results are applied on heartbeats, so keep them frequent
+    
+    # Advanced Options (Mode4), given as "key=value;key=value"
+    DEFAULT_OPTIONS = {
+        "fetch_workers": 3,     # Concurrent GET requests in one refresh cycle
+        "cycle_deadline": 5.0,  # Seconds a refresh cycle waits for its GET requests
+        "list_units": "100-199",   # Unit ranges for list devices, e.g. "100-179" or "100-229" with group_units "230-255"
+        "group_units": "200-255",  # Unit ranges for group devices
+        "domain_units": "70-84",   # Unit ranges for exact allow/deny domain devices
+        "client_units": "85-99",   # Unit ranges for client group membership devices
+        "sync_domains": False,  # Create a switch per exact allow/deny domain
+        "sync_clients": False,  # Create a switch per client and group for group membership
+        "optimistic_commands": False,  # Flip switches at once and confirm from the PUT response
+        "command_debounce": 0.0,  # Seconds to collect switch commands into one batch (0 = send at once)
+        "breaker_threshold": 3,  # Consecutive failed requests that mark Pi-hole as down
+        "breaker_backoff": 10.0,  # Seconds before the first probe of a Pi-hole that is down
+        "breaker_max_backoff": 300.0,  # Longest wait between two probes
+        "watch_clients": "",    # Comma separated client IPs or names to count queries of
+        "watch_domains": "",    # Comma separated domains (including subdomains) to count queries of
+        "watch_window": 15,     # Minutes the watched query counters cover
+        "query_page": 1000,     # Most query log rows fetched per statistics cycle
+        "stats_every": 1,       # Write the query counters only every Nth change
+        "stats_threshold": 0.0,  # ... or as soon as they grew by this many percent
+        "fan_out": True,        # Send switch commands to every Pi-hole, not only the primary
+        "metrics_devices": False,  # Publish API latency, heartbeat time etc. as Custom devices
+        "profile_every": 60,    # Heartbeats per .pstats file when Debug is set to Profile
+        "auto_gravity": False,  # Rebuild gravity after lists were switched from Domoticz
+        "auto_gravity_delay": 60.0,  # Seconds without further list changes before that rebuild starts
+    }
     
     def __init__(self):
-        self.sid = None
-        self.lists_map = {}   # Maps list_id -> unit
-        self.groups_map = {}  # Maps group_id -> unit
-        self.heartbeat_counter = 0
+        self.targets = []     # One PiHoleTarget per Pi-hole; the first is the primary
+        self.primary = None
+        self.transport = None  # TransportGroup over the transports of all targets
+        self.cache = ResponseCache(0)
+        self.changes = ChangeTracker()
+        self.inflight = {}    # Maps endpoint -> callbacks waiting for the GET in flight
+        self.coalesced = 0
+        self.scheduler = None
+        self.options = dict(self.DEFAULT_OPTIONS)
+        self.entities = self.createEntitySpecs()
+        self.lists = self.entities["list"].registry
+        self.groups = self.entities["group"].registry
+        self.last_summaries = {}  # Address -> last /stats/summary answered by that Pi-hole
+        self.client_groups = {}  # Client -> groups sent by the PUT in flight, until Pi-hole answers
+        self.group_names = {}  # Group ID -> name, rebuilt only when the groups payload changes
+        self.writer = DeviceWriter({})
+        self.metrics = Instrumentation()
+        self.profiler = None
+        self.gravity = {}  # Maps target -> GravityRunner of the rebuild in progress
+        self.gravity_due = None  # Time of the automatic rebuild after list changes
+        self.schedule = None  # ScheduleTimeline of the schedule file, None without one
+        self.heartbeat = self.MAX_HEARTBEAT  # Configured heartbeat
+        self.current_heartbeat = None  # Heartbeat last passed to Domoticz
+        self.commands = CommandQueue(0)
+        self.commands_running = 0  # Commands of the batch in flight that have not completed yet
+        self.snapshot = None
+        self.snapshot_reconciled = 0  # ChangeTracker.reconciled when the snapshot was last saved
+        self.last_stats = None
+        self.watch = UnitRegistry([(self.UNIT_WATCH_START, self.UNIT_WATCH_END)])
+        self.ingester = None
+        self.rates = None
         return
 
     def onStart(self):
@@ -67,94 +1946,614 @@ class PiHolePlugin:
         if Parameters["Mode6"] == "Debug":
             Domoticz.Debugging(1)
         
-        # Set heartbeat interval
-        interval = int(Parameters["Mode1"])
-        Domoticz.Heartbeat(interval)
+        self.options = self.parseOptions()
+        self.entities = self.createEntitySpecs()
+        self.configureEntityUnits()
+        self.lists = self.entities["list"].registry
+        self.groups = self.entities["group"].registry
+        
+        # Set heartbeat interval to the shortest polling tier
+        intervals = self.getPollIntervals()
+        heartbeat = max(1, min(self.MAX_HEARTBEAT, min(intervals.values())))
+        if Parameters["Mode2"] == "Worker":
+            heartbeat = min(heartbeat, self.WORKER_HEARTBEAT)
+        self.heartbeat = heartbeat
+        self.updateHeartbeat()
+        self.commands = CommandQueue(self.options["command_debounce"])
+        self.targets = self.createTargets()
+        self.primary = self.targets[0]
+        self.scheduler = PollScheduler(intervals, tolerance=heartbeat / 2)
+        Domoticz.Debug(f"Poll intervals: {intervals}, heartbeat {heartbeat}s")
+        
+        self.writer = DeviceWriter(Devices, self.options["stats_every"], self.options["stats_threshold"],
+                                   self.THROTTLED_UNITS)
         
         # Create statistics devices if they don't exist
         self.createStatisticsDevices()
+        self.syncMetricsDevices()
+        # Keep an hour of statistics samples for the rate devices
+        self.rates = RateRollup(-(-3600 // intervals[self.TIER_STATS]) + 2, ("total", "blocked"))
+        self.ingester = self.createQueryIngester()
+        self.syncWatchDevices()
         
         # Load existing mappings from Domoticz devices
-        self.loadExistingListMappings()
-        self.loadExistingGroupMappings()
-        
-        # Authenticate and sync devices
-        if self.authenticate():
-            self.syncListDevices()
-            self.syncGroupDevices()
-            self.updateDevices()
+        self.loadExistingMappings()
+        
+        # Restore what was known about Pi-hole at the last stop
+        hardware_id = Parameters.get("HardwareID", 0)
+        self.snapshot = StateSnapshot(os.path.join(Parameters["HomeFolder"], f"snapshot_{hardware_id}.json"))
+        self.restoreSnapshot()
+        self.schedule = self.loadSchedule(os.path.join(Parameters["HomeFolder"], f"schedule_{hardware_id}.txt"))
+        
+        if Parameters["Mode6"] == "Profile":
+            self.profiler = HeartbeatProfiler(os.path.join(Parameters["HomeFolder"], f"profile_{hardware_id}"),
+                                              max(1, self.options["profile_every"]))
+            Domoticz.Log(f"Profiling heartbeats to {self.profiler.prefix}_<n>.pstats")
+        
+        for target in self.targets:
+            target.transport = self.createTransport(target)
+        self.transport = TransportGroup([target.transport for target in self.targets])
+        self.cache = ResponseCache(heartbeat)
+        
+        # Authentication and the first sync run on the first heartbeat, so a Pi-hole
+        # that is down while Domoticz starts does not hold up the startup
+
+    def onStop(self):
+        Domoticz.Debug("onStop called")
+        if self.transport:
+            self.transport.stop()
+            for target in self.targets:
+                self.logout(target)
+        # Counter values held back by the stats throttle are written before Domoticz stops
+        self.writer.flush(force=True)
+        if self.profiler:
+            self.profiler.dump()
+        if self.snapshot:
+            self.saveSnapshot()
+        self.inflight.clear()
+        self.cache.clear()
+        self.changes.forget()
+
+    def onConnect(self, Connection, Status, Description):
+        Domoticz.Debug("onConnect called")
+        self.transport.onConnect(Connection, Status, Description)
+
+    def onMessage(self, Connection, Data):
+        Domoticz.Debug("onMessage called")
+        self.transport.onMessage(Connection, Data)
+
+    def onCommand(self, Unit, Command, Level, Hue):
+        Domoticz.Debug(f"onCommand called for Unit {Unit}: Command '{Command}', Level: {Level}")
+        
+        if Unit == self.UNIT_BLOCKING:
+            self.setBlocking(Level if Command == "Set Level" else 0)
+            return
+        
+        if Unit == self.UNIT_GRAVITY_BUTTON:
+            self.startGravity()
+            return
+        
+        # Handle list, group, domain and client enable/disable commands
+        for spec in self.entities.values():
+            entity_id = spec.registry.idFor(Unit)
+            if entity_id is not None:
+                self.queueCommand((spec.kind, entity_id), Unit, f"{spec.label} ID {entity_id}",
+                                  Command.upper() == "ON", self.entitySetter(spec, entity_id))
+                return
+
+    def entitySetter(self, spec, entity_id):
+        return lambda enabled, callback: self.setEntityState(spec, entity_id, enabled, callback)
+
+    def queueCommand(self, key, Unit, label, new_state, setter):
+        """Send a state change now, or hold it for the debounce window when one is configured"""
+        if self.commands.window <= 0:
+            self.changeState(Unit, label, new_state, setter)
+            return
+        
+        # An optimistic switch flips at once; a failed batch rolls it back to its state before the first command
+        previous = None
+        if self.options["optimistic_commands"] and Unit in Devices:
+            queued = self.commands.get(key)
+            previous = queued[4] if queued else tuple(self.writer.current(Unit)[:2])
+            self.updateDevice(Unit, 1 if new_state else 0, "On" if new_state else "Off")
+        self.commands.add(key, (Unit, label, new_state, setter, previous))
+        self.updateHeartbeat()
+
+    def updateHeartbeat(self):
+        """Set the Domoticz heartbeat for what is going on
+        Every second while commands wait for or run in a batch, every few seconds while
+        gravity is rebuilt to show its progress, otherwise the configured heartbeat.
+        """
+        if self.commands or self.commands_running:
+            heartbeat = 1
+        elif self.gravity:
+            heartbeat = min(self.heartbeat, self.WORKER_HEARTBEAT)
         else:
-            Domoticz.Error("Failed to authenticate with Pi-hole")
+            heartbeat = self.heartbeat
+        if heartbeat != self.current_heartbeat:
+            Domoticz.Heartbeat(heartbeat)
+            self.current_heartbeat = heartbeat
+
+    def flushCommands(self):
+        """Send the queued commands as one batch and refresh the states once when all completed"""
+        commands, received, first_at = self.commands.take()
+        self.commands_running = len(commands)
+        results = []
+        
+        def onDone(success):
+            results.append(success)
+            self.commands_running -= 1
+            if self.commands_running:
+                return
+            Domoticz.Log(f"Command batch: {received} received, {len(commands)} PUTs issued, "
+                         f"{results.count(False)} failed, {(time.time() - first_at) * 1000:.0f} ms")
+            self.updateHeartbeat()
+            if any(results) and not self.options["optimistic_commands"]:
+                self.scheduler.trigger(self.TIER_STATE)
+                self.runScheduledTasks()
+        
+        with self.transport.batch():
+            for Unit, label, new_state, setter, previous in commands:
+                self.changeState(Unit, label, new_state, setter, onDone, previous)
+
+    def changeState(self, Unit, label, new_state, setter, done=None, previous=None):
+        """Send a list/group state change, either confirmed or optimistically
+        done(success) replaces the state refresh that otherwise follows a confirmed change;
+        previous is the state an optimistic switch rolls back to when it was flipped earlier
+        """
+        if not self.options["optimistic_commands"]:
+            def onResult(success, confirmed):
+                self.onStateChanged(Unit, label, new_state, success, refresh=done is None)
+                if done:
+                    done(success)
+            setter(new_state, onResult)
+            return
+        
+        # Flip the switch right away and remember the old state to roll back to
+        if Unit in Devices:
+            if previous is None:
+                previous = tuple(self.writer.current(Unit)[:2])
+            self.updateDevice(Unit, 1 if new_state else 0, "On" if new_state else "Off")
+        
+        def onResult(success, confirmed):
+            self.onStateConfirmed(Unit, label, new_state, previous, success, confirmed)
+            if done:
+                done(success)
+        setter(new_state, onResult)
+
+    def onStateChanged(self, Unit, label, new_state, success, refresh=True):
+        """Reflect the outcome of a list/group state change on its device"""
+        if not success:
+            Domoticz.Error(f"Failed to change state of {label.lower()}")
+            return
+        
+        # Update device state
+        if Unit in Devices:
+            nValue = 1 if new_state else 0
+            sValue = "On" if new_state else "Off"
+            self.updateDevice(Unit, nValue, sValue)
+            Domoticz.Log(f"{label} ('{self.writer.current(Unit)[2]}') set to {'enabled' if new_state else 'disabled'}")
+        
+        # Force immediate refresh of the states after a change
+        if refresh:
+            self.scheduler.trigger(self.TIER_STATE)
+            self.runScheduledTasks()
+
+    def onStateConfirmed(self, Unit, label, new_state, previous, success, confirmed):
+        """Confirm or roll back an optimistic list/group state change"""
+        if not success:
+            Domoticz.Error(f"Failed to change state of {label.lower()}, reverting the switch")
+            if previous is not None:
+                self.updateDevice(Unit, *previous)
+            return
+        
+        # Pi-hole returns the updated object; trust it over the requested state
+        enabled = confirmed.enabled if confirmed is not None else new_state
+        if Unit in Devices:
+            self.updateDevice(Unit, 1 if enabled else 0, "On" if enabled else "Off")
+            Domoticz.Log(f"{label} ('{self.writer.current(Unit)[2]}') confirmed {'enabled' if enabled else 'disabled'}")
+
+    def onNotification(self, Name, Subject, Text, Status, Priority, Sound, ImageFile):
+        Domoticz.Debug("onNotification called")
+
+    def onDisconnect(self, Connection):
+        Domoticz.Debug("onDisconnect called")
+        self.transport.onDisconnect(Connection)
+
+    def onHeartbeat(self):
+        Domoticz.Debug("onHeartbeat called")
+        
+        self.transport.onHeartbeat()
+        if self.commands.due() and not self.commands_running:
+            self.flushCommands()
+        if self.gravity:
+            self.pollGravity()
+        elif self.gravity_due and time.time() >= self.gravity_due:
+            self.gravity_due = None
+            Domoticz.Log("Lists were changed, rebuilding gravity")
+            self.startGravity()
+        
+        if self.transport.isBusy():
+            Domoticz.Debug("Previous update still waiting for Pi-hole, skipping this heartbeat")
+            return
+        
+        # The previous cycle has completed, persist what it changed
+        if self.changes.reconciled != self.snapshot_reconciled:
+            self.saveSnapshot()
+        
+        # While a Pi-hole is down only a single probe is sent to it once the backoff has passed
+        for target in self.targets:
+            if not target.breaker.isClosed() and target.breaker.probeDue():
+                self.probe(target)
+        if not self.primary.breaker.isClosed():
+            return
+        
+        if self.schedule and not self.commands_running:
+            self.applySchedule()
+        
+        if not self.scheduler.due():
+            return
+        
+        Domoticz.Debug(f"Response cache: {self.cache.hits} hits, {self.cache.misses} misses, "
+                       f"{self.coalesced} coalesced")
+        Domoticz.Debug(f"Change detection: {self.changes.skipped} payloads skipped, "
+                       f"{self.changes.reconciled} reconciled")
+        Domoticz.Debug(f"HTTP: {self.transport.describeStats()}")
+        Domoticz.Debug(f"Device writes: {self.writer.describeStats()}")
+        self.publishMetrics()
+        self.cache.newCycle()
+        
+        # Renew sessions only when they are missing or about to expire
+        stale = [target for target in self.targets if target.breaker.isClosed() and target.session.needsRenewal()]
+        if stale:
+            remaining = [len(stale)]
+            
+            def onAuthenticated(success):
+                remaining[0] -= 1
+                if not remaining[0]:
+                    self.onReauthenticated(self.primary.session.sid is not None)
+            for target in stale:
+                self.authenticate(onAuthenticated, target)
+            return
+        
+        self.runScheduledTasks()
+
+    @contextlib.contextmanager
+    def callback(self, name):
+        """Run a Domoticz callback: merge its device writes and record how long it took"""
+        start = time.perf_counter()
+        profiling = self.profiler.run() if self.profiler and name == "heartbeat" else contextlib.nullcontext()
+        with profiling:
+            with self.writer.batch():
+                yield
+        self.metrics.callback(name, time.perf_counter() - start, self.writer.last_writes)
+
+    def publishMetrics(self):
+        """Log the instrumentation of the last window and show it on the metrics devices"""
+        window = self.metrics.take()
+        Domoticz.Debug(f"Timings: {window.describe()}")
+        if not self.options["metrics_devices"]:
+            return
+        requests = window.requests
+        heartbeat = window.callbacks.get("heartbeat")
+        self.updateDevice(self.UNIT_API_LATENCY_P50, 0, f"{requests.percentile(50):.0f}")
+        self.updateDevice(self.UNIT_API_LATENCY_P95, 0, f"{requests.percentile(95):.0f}")
+        self.updateDevice(self.UNIT_API_LATENCY_MAX, 0, f"{requests.max:.0f}")
+        self.updateDevice(self.UNIT_HEARTBEAT_TIME, 0, f"{heartbeat.max if heartbeat else 0:.1f}")
+        self.updateDevice(self.UNIT_KB_RECEIVED, 0, f"{window.bytes_received / 1024:.1f}")
+        self.updateDevice(self.UNIT_JSON_PARSE_TIME, 0, f"{window.parse_seconds * 1000:.1f}")
+        self.updateDevice(self.UNIT_DEVICE_WRITES, 0, str(window.writes))
 
-    def onStop(self):
-        Domoticz.Debug("onStop called")
+    def syncMetricsDevices(self):
+        """Create the instrumentation devices when metrics_devices is set, remove them otherwise"""
+        devices = ((self.UNIT_API_LATENCY_P50, "API Latency p50", "ms"),
+                   (self.UNIT_API_LATENCY_P95, "API Latency p95", "ms"),
+                   (self.UNIT_API_LATENCY_MAX, "API Latency max", "ms"),
+                   (self.UNIT_HEARTBEAT_TIME, "Plugin Heartbeat max", "ms"),
+                   (self.UNIT_KB_RECEIVED, "API Data Received", "kB"),
+                   (self.UNIT_JSON_PARSE_TIME, "JSON Parse Time", "ms"),
+                   (self.UNIT_DEVICE_WRITES, "Device Writes", "writes"))
+        for unit, name, label in devices:
+            if not self.options["metrics_devices"]:
+                if unit in Devices:
+                    Devices[unit].Delete()
+                    self.writer.forget(unit)
+            elif unit not in Devices:
+                Domoticz.Device(Name=name, Unit=unit, TypeName="Custom",
+                                Options={"Custom": f"1;{label}"}, Used=1).Create()
 
-    def onConnect(self, Connection, Status, Description):
-        Domoticz.Debug("onConnect called")
+    def onReauthenticated(self, success):
+        if success:
+            self.runScheduledTasks()
+        else:
+            Domoticz.Error("Re-authentication failed")
 
-    def onMessage(self, Connection, Data):
-        Domoticz.Debug("onMessage called")
+    def runScheduledTasks(self):
+        """Queue the requests of every polling tier that is due"""
+        due = self.scheduler.due()
+        Domoticz.Debug(f"Polling tiers due: {', '.join(due) if due else 'none'}")
+        
+        # The GETs of all due tiers are independent, fetch them concurrently
+        with self.transport.batch():
+            # Sync devices first so that new entities exist before states are applied
+            if self.TIER_SYNC in due:
+                for spec in self.entities.values():
+                    self.apiGet(spec.endpoint, functools.partial(self.applySync, spec))
+            
+            if self.TIER_STATE in due:
+                self.updateStates()
+            
+            if self.TIER_STATS in due:
+                self.updateStatistics()
+        
+        for tier in due:
+            self.scheduler.markRun(tier)
 
-    def onCommand(self, Unit, Command, Level, Hue):
-        Domoticz.Debug(f"onCommand called for Unit {Unit}: Command '{Command}', Level: {Level}")
+    def loadSchedule(self, path):
+        """Read the schedule rules of this hardware; returns None when there is no schedule file"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            Domoticz.Error(f"Cannot read schedule {path}: {e}")
+            return None
         
-        # Handle list enable/disable commands
-        if Unit >= self.UNIT_LISTS_START and Unit < self.UNIT_GROUPS_START:
-            list_id = self.getListIdFromUnit(Unit)
-            if list_id:
-                new_state = (Command.upper() == "ON")
-                if self.setListState(list_id, new_state):
-                    # Update device state
-                    nValue = 1 if new_state else 0
-                    sValue = "On" if new_state else "Off"
-                    Devices[Unit].Update(nValue=nValue, sValue=sValue)
-                    Domoticz.Log(f"List ID {list_id} ('{Devices[Unit].Name}') set to {'enabled' if new_state else 'disabled'}")
-                    
-                    # Force immediate refresh after state change
-                    self.updateDevices()
-                else:
-                    Domoticz.Error(f"Failed to change state of list ID {list_id}")
-        
-        # Handle group enable/disable commands
-        elif Unit >= self.UNIT_GROUPS_START:
-            group_id = self.getGroupIdFromUnit(Unit)
-            if group_id is not None:
-                new_state = (Command.upper() == "ON")
-                if self.setGroupState(group_id, new_state):
-                    # Update device state
-                    nValue = 1 if new_state else 0
-                    sValue = "On" if new_state else "Off"
-                    Devices[Unit].Update(nValue=nValue, sValue=sValue)
-                    Domoticz.Log(f"Group ID {group_id} ('{Devices[Unit].Name}') set to {'enabled' if new_state else 'disabled'}")
-                    
-                    # Force immediate refresh after state change
-                    self.updateDevices()
-                else:
-                    Domoticz.Error(f"Failed to change state of group ID {group_id}")
+        schedule = ScheduleTimeline()
+        for error in schedule.parse(text):
+            Domoticz.Error(f"Schedule {path}, {error}")
+        for kind, reference in schedule.rules:
+            if kind not in self.entities:
+                Domoticz.Error(f"Schedule {path}: '{kind}' is not a mirrored kind, "
+                               f"use one of {', '.join(self.entities)}")
+        Domoticz.Log(f"Loaded schedule with {len(schedule)} rules and {len(schedule.timeline)} weekly transitions")
+        return schedule
 
-    def onNotification(self, Name, Subject, Text, Status, Priority, Sound, ImageFile):
-        Domoticz.Debug("onNotification called")
+    def applySchedule(self):
+        """Send the state changes of the schedule transitions that are due as one command batch
+        The first run, once Pi-hole's states are known, compares every scheduled entity with the
+        state its rules want right now, which also catches up on transitions missed while stopped;
+        only entities whose state differs are switched. Later transitions are always sent, like a
+        Domoticz timer, as the state may have been changed on Pi-hole since the last poll.
+        """
+        now = time.time()
+        reconcile = self.schedule.checked_at is None
+        if reconcile:
+            # markRun of the state tier means its responses have been applied by now
+            if not self.scheduler.next_due[self.TIER_STATE]:
+                return
+            wanted = self.schedule.desired(now)
+        else:
+            wanted = self.schedule.due(now)
+        if not wanted:
+            return
+        
+        for (kind, reference), enabled in wanted.items():
+            spec = self.entities.get(kind)
+            record = self.findScheduled(spec, reference) if spec else None
+            if record is None:
+                Domoticz.Error(f"Schedule: no {kind} '{reference}' on Pi-hole")
+                continue
+            unit = spec.registry.unitFor(record.id)
+            if unit is None or (reconcile and record.enabled == enabled):
+                continue
+            self.commands.add((kind, record.id), (unit, f"{spec.label} ID {record.id}", enabled,
+                                                  self.entitySetter(spec, record.id), None))
+        Domoticz.Debug(f"Schedule: {len(wanted)} entities due, {len(self.commands)} to switch, next transition "
+                       f"{time.strftime('%a %H:%M', time.localtime(self.schedule.next_at)) if self.schedule.timeline else 'none'}")
+        if self.commands:
+            self.flushCommands()
 
-    def onDisconnect(self, Connection):
-        Domoticz.Debug("onDisconnect called")
+    def findScheduled(self, spec, reference):
+        """Find the record a schedule rule refers to by ID, name or address"""
+        name = reference.lower()
+        for record in spec.registry.records.values():
+            if str(record.id) == reference or name in (str(record.name).lower(), str(record.address).lower()):
+                return record
+        return None
 
-    def onHeartbeat(self):
-        Domoticz.Debug("onHeartbeat called")
+    def saveSnapshot(self):
+        """Write the unit registries, payload fingerprints and last statistics to the snapshot file"""
+        data = {
+            "address": Parameters["Address"],
+            "saved": int(time.time()),
+            "entities": {kind: [[unit] + spec.registry.records[entity_id].toSnapshot()
+                                for entity_id, unit in spec.registry.unit_by_id.items()
+                                if entity_id in spec.registry.records]
+                         for kind, spec in self.entities.items()},
+            "units": {kind: spec.registry.ranges for kind, spec in self.entities.items()},
+            "fingerprints": self.changes.export(),
+            "stats": self.last_stats,
+        }
+        if self.snapshot.save(data):
+            self.snapshot_reconciled = self.changes.reconciled
+            Domoticz.Debug("Saved state snapshot with " + ", ".join(
+                f"{len(entries)} {kind}s" for kind, entries in data["entities"].items()))
+
+    def restoreSnapshot(self):
+        """Restore entity records and fingerprints when the snapshot matches the existing devices"""
+        data = self.snapshot.load()
+        if not data:
+            return
+        if data.get("address") != Parameters["Address"]:
+            Domoticz.Log("State snapshot belongs to another Pi-hole address, ignoring it")
+            return
         
-        # Re-authenticate every 10 heartbeats (session might expire)
-        self.heartbeat_counter += 1
-        if self.heartbeat_counter >= 10:
-            self.heartbeat_counter = 0
-            if not self.authenticate():
-                Domoticz.Error("Re-authentication failed")
+        # Entities that found no unit under the old ranges may fit now
+        units = {kind: [list(r) for r in spec.registry.ranges] for kind, spec in self.entities.items()}
+        if data.get("units") != units:
+            Domoticz.Log("Unit ranges changed since the state snapshot was saved, running a full sync")
+            return
+        
+        restored = {}
+        for kind, spec in self.entities.items():
+            records = {}
+            for values in data["entities"].get(kind, []):
+                record = EntityRecord.fromSnapshot(values[1:])
+                if spec.registry.unitFor(record.id) != values[0]:
+                    break
+                records[record.id] = record
+            # Devices created or deleted since the snapshot was saved need a full sync
+            if len(records) != len(spec.registry):
+                Domoticz.Log(f"State snapshot does not match the {spec.collection} devices, running a full sync")
                 return
+            restored[kind] = records
+        
+        for kind, records in restored.items():
+            self.entities[kind].registry.records = records
+        self.changes.restore(data.get("fingerprints", {}))
+        self.group_names = self.indexGroupNames()
+        self.last_stats = data.get("stats")
+        # The restored fingerprint skips an unchanged summary, so the devices must show it already
+        if self.last_stats:
+            self.showStatistics(self.last_stats)
+        Domoticz.Log("Restored state of " + ", ".join(
+            f"{len(records)} {kind}s" for kind, records in restored.items()) +
+            f" saved {int(time.time()) - data.get('saved', 0)}s ago")
+
+    def getPollIntervals(self):
+        """Parse the stats;state;sync intervals, falling back to the Update Interval"""
+        interval = int(Parameters["Mode1"])
+        intervals = {self.TIER_STATS: interval, self.TIER_STATE: interval,
+                     self.TIER_SYNC: max(interval, self.DEFAULT_SYNC_INTERVAL)}
         
-        # Sync devices (check for added/removed lists and groups)
-        self.syncListDevices()
-        self.syncGroupDevices()
+        values = [v.strip() for v in Parameters["Mode3"].split(';')] if Parameters["Mode3"].strip() else []
+        for tier, value in zip((self.TIER_STATS, self.TIER_STATE, self.TIER_SYNC), values):
+            if not value:
+                continue
+            try:
+                intervals[tier] = max(1, int(value))
+            except ValueError:
+                Domoticz.Error(f"Invalid {tier} poll interval '{value}', using {intervals[tier]}s")
+        return intervals
+
+    def createTargets(self):
+        """Create a target per Pi-hole in the comma separated Address parameter
+        With several addresses the Password may hold one password per address, in
+        the same order, or a single password used for all of them.
+        """
+        addresses = [address.strip() for address in Parameters["Address"].split(',') if address.strip()]
+        passwords = [Parameters["Password"]]
+        if len(addresses) > 1:
+            passwords = [password.strip() for password in Parameters["Password"].split(',')]
+            if len(passwords) != len(addresses):
+                if len(passwords) != 1:
+                    Domoticz.Error(f"{len(addresses)} Pi-hole addresses but {len(passwords)} passwords, "
+                                   f"using the first password for all")
+                passwords = passwords[:1] * len(addresses)
+            Domoticz.Log(f"Controlling {len(addresses)} Pi-holes, {addresses[0]} is the primary")
+        
+        targets = []
+        for index, (address, password) in enumerate(zip(addresses, passwords)):
+            target = PiHoleTarget(index, address, password)
+            target.breaker = CircuitBreaker(self.options["breaker_threshold"], self.options["breaker_backoff"],
+                                            self.options["breaker_max_backoff"])
+            targets.append(target)
+        return targets
+
+    def createTransport(self, target):
+        """Create the transport selected by the Connection Mode parameter for one Pi-hole"""
+        workers = self.options["fetch_workers"]
+        deadline = self.options["cycle_deadline"]
+        projections = {spec.endpoint: spec.fields for spec in self.entities.values()}
+        if Parameters["Mode2"] == "Async":
+            if target is self.primary:
+                Domoticz.Log("Using non-blocking Domoticz.Connection transport")
+            return AsyncTransport(target.address, target.getSid,
+                                  name=f"{AsyncTransport.CONNECTION_NAME}{target.index or ''}", metrics=self.metrics,
+                                  projections=projections)
+        if Parameters["Mode2"] == "Worker":
+            if target is self.primary:
+                Domoticz.Log("Using background thread transport")
+            return WorkerTransport(target.address, target.getSid, workers=workers, deadline=deadline,
+                                   metrics=self.metrics, projections=projections)
+        return BlockingTransport(target.address, target.getSid, workers=workers, deadline=deadline,
+                                 metrics=self.metrics, projections=projections)
+
+    def parseOptions(self):
+        """Parse the Advanced Options parameter into a dict, keeping defaults for missing keys"""
+        options = dict(self.DEFAULT_OPTIONS)
+        for item in Parameters["Mode4"].split(';'):
+            key, _, value = item.partition('=')
+            key = key.strip()
+            if not key:
+                continue
+            if key not in options:
+                Domoticz.Error(f"Unknown advanced option '{key}'")
+                continue
+            
+            default = options[key]
+            value = value.strip()
+            try:
+                if isinstance(default, bool):
+                    options[key] = value.lower() in ("1", "true", "yes", "on")
+                else:
+                    options[key] = type(default)(value)
+            except ValueError:
+                Domoticz.Error(f"Invalid value '{value}' for advanced option '{key}', using {default}")
         
-        # Update all devices
-        self.updateDevices()
+        Domoticz.Debug(f"Advanced options: {options}")
+        return options
+
+    def createEntitySpecs(self):
+        """Describe the Pi-hole entity types mirrored as switches; domains and clients are opt-in"""
+        # Groups come first so list names can use the group names of the same sync
+        specs = [
+            EntitySpec("group", "Group", "/groups", "groups", "GroupID:", EntityRecord.fromGroup,
+                       self.generateGroupDeviceName, self.groupUpdate,
+                       fields=('id', 'name', 'comment', 'enabled')),
+            EntitySpec("list", "List", "/lists", "lists", "ListID:", EntityRecord.fromList,
+                       self.generateListDeviceName, self.listUpdate,
+                       fields=('id', 'address', 'type', 'comment', 'groups', 'enabled')),
+        ]
+        if self.options["sync_domains"]:
+            # Regex entries have no meaningful on/off per domain name, only exact ones are mirrored
+            specs.append(EntitySpec("domain", "Domain", "/domains", "domains", "DomainID:", EntityRecord.fromDomain,
+                                    self.generateDomainDeviceName, self.domainUpdate,
+                                    entries=lambda payload: [d for d in payload['domains'] if d.get('kind') == 'exact'],
+                                    fields=('id', 'domain', 'type', 'kind', 'comment', 'groups', 'enabled')))
+        if self.options["sync_clients"]:
+            specs.append(EntitySpec("client", "Client group", "/clients", "clients", "ClientGroup:",
+                                    EntityRecord.fromClientGroup, self.generateClientGroupDeviceName,
+                                    self.clientGroupUpdate, entries=self.clientGroupEntries, parse_id=str,
+                                    fields=('id', 'client', 'name', 'comment', 'groups')))
+        return {spec.kind: spec for spec in specs}
+
+    def configureEntityUnits(self):
+        """Give every entity type its unit registry from the configured unit ranges"""
+        ranges = {}
+        try:
+            for kind in self.entities:
+                ranges[kind] = self.parseUnitRanges(self.options[f"{kind}_units"])
+            
+            kinds = list(ranges)
+            for i, kind in enumerate(kinds):
+                for other in kinds[i + 1:]:
+                    for first, last in ranges[kind]:
+                        for other_first, other_last in ranges[other]:
+                            if first <= other_last and other_first <= last:
+                                raise ValueError(f"{kind} and {other} units overlap")
+        except ValueError as e:
+            Domoticz.Error(f"Invalid unit range: {e}, using the default ranges")
+            ranges = {kind: self.parseUnitRanges(self.DEFAULT_OPTIONS[f"{kind}_units"]) for kind in self.entities}
+        
+        for kind, spec in self.entities.items():
+            spec.registry = UnitRegistry(ranges[kind])
+        Domoticz.Debug("Unit capacity: " + ", ".join(
+            f"{spec.registry.capacity()} {spec.collection}" for spec in self.entities.values()))
+
+    def parseUnitRanges(self, text):
+        """Parse "100-199,70-99" into [(100, 199), (70, 99)]"""
+        ranges = []
+        for part in text.split(','):
+            first, _, last = part.strip().partition('-')
+            first = int(first)
+            last = int(last) if last else first
+            if not self.UNIT_ENTITIES_START <= first <= last <= self.UNIT_MAX:
+                raise ValueError(f"'{part.strip()}' is outside {self.UNIT_ENTITIES_START}-{self.UNIT_MAX}")
+            ranges.append((first, last))
+        return ranges
 
     def createStatisticsDevices(self):
         """Create statistics monitoring devices"""
@@ -199,250 +2598,372 @@ class PiHolePlugin:
         if self.UNIT_STATUS not in Devices:
             Domoticz.Device(Name="Pi-hole Status", Unit=self.UNIT_STATUS, 
                           TypeName="Switch", Switchtype=0, Used=1).Create()
-
-    def loadExistingListMappings(self):
-        """Load existing list ID to unit mappings from device descriptions"""
-        for unit, device in Devices.items():
-            if unit >= self.UNIT_LISTS_START and unit < self.UNIT_GROUPS_START and device.Description.startswith("ListID:"):
-                try:
-                    list_id = int(device.Description.split(":")[1])
-                    self.lists_map[list_id] = unit
-                    Domoticz.Debug(f"Loaded mapping: List ID {list_id} -> Unit {unit}")
-                except:
-                    pass
-
-    def loadExistingGroupMappings(self):
-        """Load existing group ID to unit mappings from device descriptions"""
-        for unit, device in Devices.items():
-            if unit >= self.UNIT_GROUPS_START and device.Description.startswith("GroupID:"):
-                try:
-                    group_id = int(device.Description.split(":")[1])
-                    self.groups_map[group_id] = unit
-                    Domoticz.Debug(f"Loaded mapping: Group ID {group_id} -> Unit {unit}")
-                except:
-                    pass
-
-    def syncListDevices(self):
-        """Synchronize list devices with Pi-hole - add new, remove deleted, update names"""
-        
-        Domoticz.Debug("=== Starting list synchronization ===")
-        
-        lists_data = self.apiGet("/lists")
-        if not lists_data or 'lists' not in lists_data:
-            Domoticz.Error("Failed to get lists from Pi-hole")
-            return
         
-        # Log what we received
-        Domoticz.Debug(f"Received {len(lists_data['lists'])} lists from Pi-hole API")
-        for lst in lists_data['lists']:
-            Domoticz.Debug(f"  Pi-hole list: ID={lst.get('id')}, address={lst.get('address')}, enabled={lst.get('enabled')}")
+        if self.UNIT_BLOCKING not in Devices:
+            Domoticz.Device(Name="Pi-hole Blocking", Unit=self.UNIT_BLOCKING, 
+                          TypeName="Selector Switch", Switchtype=18, Used=1,
+                          Options={"LevelActions": "||||", "LevelNames": "On|Pause 5 min|Pause 30 min|Pause 1 h|Off",
+                                   "LevelOffHidden": "false", "SelectorStyle": "1"}).Create()
         
-        current_lists = {lst.get('id'): lst for lst in lists_data['lists']}
-        current_list_ids = set(current_lists.keys())
-        existing_list_ids = set(self.lists_map.keys())
+        if self.UNIT_BLOCKING_TIMER not in Devices:
+            Domoticz.Device(Name="Pi-hole Blocking Timer", Unit=self.UNIT_BLOCKING_TIMER, 
+                          TypeName="Text", Used=1).Create()
         
-        Domoticz.Debug(f"Current Pi-hole list IDs: {sorted(current_list_ids)}")
-        Domoticz.Debug(f"Existing Domoticz list IDs: {sorted(existing_list_ids)}")
+        if self.UNIT_GRAVITY_BUTTON not in Devices:
+            Domoticz.Device(Name="Update Gravity", Unit=self.UNIT_GRAVITY_BUTTON, 
+                          TypeName="Switch", Switchtype=9, Used=1).Create()
         
-        # Find new lists (in Pi-hole but not in Domoticz)
-        new_list_ids = current_list_ids - existing_list_ids
+        if self.UNIT_GRAVITY_STATUS not in Devices:
+            Domoticz.Device(Name="Gravity Status", Unit=self.UNIT_GRAVITY_STATUS, 
+                          TypeName="Text", Used=1).Create()
         
-        # Find removed lists (in Domoticz but not in Pi-hole)
-        removed_list_ids = existing_list_ids - current_list_ids
+        if self.UNIT_QUERIES_PER_MINUTE not in Devices:
+            Domoticz.Device(Name="Queries per Minute", Unit=self.UNIT_QUERIES_PER_MINUTE, 
+                          TypeName="Custom", Options={"Custom": "1;queries/min"}, Used=1).Create()
         
-        if new_list_ids:
-            Domoticz.Log(f"Found {len(new_list_ids)} new list(s) to add: {new_list_ids}")
-        if removed_list_ids:
-            Domoticz.Log(f"Found {len(removed_list_ids)} deleted list(s) to remove: {removed_list_ids}")
+        if self.UNIT_BLOCKED_PER_MINUTE not in Devices:
+            Domoticz.Device(Name="Ads Blocked per Minute", Unit=self.UNIT_BLOCKED_PER_MINUTE, 
+                          TypeName="Custom", Options={"Custom": "1;ads/min"}, Used=1).Create()
         
-        # Remove deleted lists from Domoticz
-        for list_id in removed_list_ids:
-            unit = self.lists_map.get(list_id)
-            if unit and unit in Devices:
-                device_name = Devices[unit].Name
-                Domoticz.Log(f"Removing device for deleted list ID {list_id}: {device_name} (Unit {unit})")
-                Devices[unit].Delete()
-            if list_id in self.lists_map:
-                del self.lists_map[list_id]
-        
-        # Add new lists to Domoticz
-        for list_id in new_list_ids:
-            lst = current_lists[list_id]
-            self.createListDevice(list_id, lst)
-        
-        # Update existing list names and states (in case comment/group changed)
-        for list_id in (existing_list_ids & current_list_ids):
-            lst = current_lists[list_id]
-            unit = self.lists_map.get(list_id)
-            
-            if unit and unit in Devices:
-                new_name = self.generateListDeviceName(lst)
-                if Devices[unit].Name != new_name:
-                    old_name = Devices[unit].Name
-                    Devices[unit].Update(Name=new_name, nValue=Devices[unit].nValue, 
-                                       sValue=Devices[unit].sValue)
-                    Domoticz.Log(f"Updated list name from '{old_name}' to '{new_name}'")
+        if self.UNIT_QUERIES_PER_HOUR not in Devices:
+            Domoticz.Device(Name="Queries per Hour", Unit=self.UNIT_QUERIES_PER_HOUR, 
+                          TypeName="Custom", Options={"Custom": "1;queries/h"}, Used=1).Create()
         
-        Domoticz.Debug("=== Finished list synchronization ===")
+        if self.UNIT_BLOCKED_PER_HOUR not in Devices:
+            Domoticz.Device(Name="Ads Blocked per Hour", Unit=self.UNIT_BLOCKED_PER_HOUR, 
+                          TypeName="Custom", Options={"Custom": "1;ads/h"}, Used=1).Create()
 
-    def syncGroupDevices(self):
-        """Synchronize group devices with Pi-hole - add new, remove deleted, update names"""
-        
-        Domoticz.Debug("=== Starting group synchronization ===")
+    def loadExistingMappings(self):
+        """Load existing entity ID to unit mappings from device descriptions"""
+        # Devices outside the configured range are kept, so changing ranges never orphans a device
+        for unit, device in Devices.items():
+            for spec in self.entities.values():
+                if device.Description.startswith(spec.prefix):
+                    try:
+                        entity_id = spec.parse_id(device.Description[len(spec.prefix):])
+                        spec.registry.add(entity_id, unit)
+                        Domoticz.Debug(f"Loaded mapping: {spec.label} ID {entity_id} -> Unit {unit}")
+                    except ValueError:
+                        pass
+                    break
+
+    def applySync(self, spec, payload):
+        """Reconcile the devices of one entity type with a Pi-hole response
+        One pass over the entries collects the devices to create, delete, rename
+        and switch; only entries that changed since the last sync are looked at.
+        """
+        Domoticz.Debug(f"=== Starting {spec.kind} synchronization ===")
         
-        groups_data = self.apiGet("/groups")
-        if not groups_data or 'groups' not in groups_data:
-            Domoticz.Error("Failed to get groups from Pi-hole")
+        if not payload or spec.collection not in payload:
+            Domoticz.Error(f"Failed to get {spec.collection} from Pi-hole")
             return
         
-        # Log what we received
-        Domoticz.Debug(f"Received {len(groups_data['groups'])} groups from Pi-hole API")
-        for grp in groups_data['groups']:
-            Domoticz.Debug(f"  Pi-hole group: ID={grp.get('id')}, name={grp.get('name')}, enabled={grp.get('enabled')}")
-        
-        current_groups = {grp.get('id'): grp for grp in groups_data['groups']}
-        current_group_ids = set(current_groups.keys())
-        existing_group_ids = set(self.groups_map.keys())
-        
-        Domoticz.Debug(f"Current Pi-hole group IDs: {sorted(current_group_ids)}")
-        Domoticz.Debug(f"Existing Domoticz group IDs: {sorted(existing_group_ids)}")
-        
-        # Find new groups
-        new_group_ids = current_group_ids - existing_group_ids
-        
-        # Find removed groups
-        removed_group_ids = existing_group_ids - current_group_ids
-        
-        if new_group_ids:
-            Domoticz.Log(f"Found {len(new_group_ids)} new group(s) to add: {new_group_ids}")
-        if removed_group_ids:
-            Domoticz.Log(f"Found {len(removed_group_ids)} deleted group(s) to remove: {removed_group_ids}")
+        key = f"sync:{spec.endpoint}"
+        if not self.changes.changed(key, payload):
+            Domoticz.Debug(f"{spec.label}s unchanged since the last sync, skipping")
+            return
         
-        # Remove deleted groups from Domoticz
-        for group_id in removed_group_ids:
-            unit = self.groups_map.get(group_id)
+        registry = spec.registry
+        try:
+            entries = list(spec.entries(payload))
+        except ValueError as e:
+            Domoticz.Debug(f"Skipping {spec.kind} synchronization: {e}")
+            self.changes.forget(key)
+            return
+        changed = self.changes.changedEntries(key, entries)
+        
+        seen = set()
+        creates = []
+        updates = []
+        for entry in entries:
+            entity_id = entry.get('id')
+            seen.add(entity_id)
+            unit = registry.unitFor(entity_id)
+            # Entities that still have no device (e.g. no free unit last time) are retried too
+            if unit is None:
+                record = registry.records[entity_id] = spec.record(entry)
+                creates.append(record)
+            elif entity_id in changed:
+                record = registry.records[entity_id] = spec.record(entry)
+                current = self.writer.current(unit)
+                if current:
+                    name = spec.name(record)
+                    nValue = 1 if record.enabled else 0
+                    if current[2] != name or current[0] != nValue:
+                        updates.append((unit, name, nValue))
+        removes = [entity_id for entity_id in registry.ids() if entity_id not in seen]
+        
+        if creates:
+            Domoticz.Log(f"Found {len(creates)} new {spec.kind}(s) to add: {[record.id for record in creates]}")
+        if removes:
+            Domoticz.Log(f"Found {len(removes)} deleted {spec.kind}(s) to remove: {removes}")
+        
+        for entity_id in removes:
+            unit = registry.release(entity_id)
             if unit and unit in Devices:
-                device_name = Devices[unit].Name
-                Domoticz.Log(f"Removing device for deleted group ID {group_id}: {device_name} (Unit {unit})")
+                Domoticz.Log(f"Removing device for deleted {spec.kind} ID {entity_id}: {Devices[unit].Name} (Unit {unit})")
                 Devices[unit].Delete()
-            if group_id in self.groups_map:
-                del self.groups_map[group_id]
-        
-        # Add new groups to Domoticz
-        for group_id in new_group_ids:
-            grp = current_groups[group_id]
-            self.createGroupDevice(group_id, grp)
-        
-        # Update existing group names and states
-        for group_id in (existing_group_ids & current_group_ids):
-            grp = current_groups[group_id]
-            unit = self.groups_map.get(group_id)
-            
-            if unit and unit in Devices:
-                new_name = f"Group: {grp.get('name', 'Unnamed Group')}"
-                if Devices[unit].Name != new_name:
-                    old_name = Devices[unit].Name
-                    Devices[unit].Update(Name=new_name, nValue=Devices[unit].nValue, 
-                                       sValue=Devices[unit].sValue)
-                    Domoticz.Log(f"Updated group name from '{old_name}' to '{new_name}'")
+                self.writer.forget(unit)
+        
+        # Add new entities to Domoticz, lowest ID first
+        # Integer IDs sort numerically; client group IDs are strings and sort as text
+        for record in sorted(creates, key=lambda record: (isinstance(record.id, str), record.id)):
+            self.createEntityDevice(spec, record)
+        
+        # Rename and switch in a single device update
+        for unit, name, nValue in updates:
+            current_name = self.writer.current(unit)[2]
+            if current_name != name:
+                Domoticz.Log(f"Updated {spec.kind} name from '{current_name}' to '{name}'")
+            self.writer.update(unit, nValue, "On" if nValue else "Off", name)
+        
+        # Entities left without a unit are not synced; the next sync must not skip them as unchanged
+        if any(registry.unitFor(record.id) is None for record in creates):
+            self.changes.forget(key)
+        
+        Domoticz.Debug(f"=== Finished {spec.kind} synchronization: {len(changed)} reconciled, "
+                       f"{len(entries) - len(changed)} skipped, {len(creates)} created, "
+                       f"{len(removes)} removed, {len(updates)} updated ===")
+        
+        if spec.kind == "group":
+            self.refreshGroupNames()
+
+    def indexGroupNames(self):
+        """Build the group ID -> name index from the known group records"""
+        return {group_id: record.name for group_id, record in self.groups.records.items() if record.name}
+
+    def refreshGroupNames(self):
+        """Rebuild the group name index and rename the list and client devices of renamed groups"""
+        previous = self.group_names
+        self.group_names = self.indexGroupNames()
+        renamed = {group_id for group_id in previous.keys() | self.group_names.keys()
+                   if previous.get(group_id) != self.group_names.get(group_id)}
+        if not renamed:
+            return
         
-        Domoticz.Debug("=== Finished group synchronization ===")
+        renames = []
+        for kind in ("list", "client"):
+            spec = self.entities.get(kind)
+            if spec is None:
+                continue
+            for entity_id, record in spec.registry.records.items():
+                # Client records reference their group through type, lists through groups
+                if not renamed.intersection(record.groups if kind == "list" else (record.type,)):
+                    continue
+                unit = spec.registry.unitFor(entity_id)
+                name = spec.name(record)
+                current = self.writer.current(unit) if unit is not None else None
+                if current and current[2] != name:
+                    renames.append((unit, current[2], name))
+        
+        for unit, old_name, name in renames:
+            Domoticz.Log(f"Renamed '{old_name}' to '{name}' after a group change")
+            self.writer.update(unit, name=name)
+        Domoticz.Debug(f"Group names changed for IDs {sorted(renamed)}, {len(renames)} device(s) renamed")
 
     def generateListDeviceName(self, lst):
         """Generate device name for a list"""
-        comment = lst.get('comment', 'Unnamed List')
-        groups = lst.get('groups', [])
+        comment = lst.name
+        groups = lst.groups
         
-        # Group names mapping
-        group_names = {0: "Default", 1: "Kids"}
         if groups:
-            group_str = ', '.join(group_names.get(g, f"Group {g}") for g in groups)
+            group_str = ', '.join(self.group_names.get(g, f"Group {g}") for g in groups)
             return f"List: {comment} ({group_str})"
         else:
             return f"List: {comment}"
 
-    def createListDevice(self, list_id, lst):
-        """Create a new device for a block list"""
+    def generateGroupDeviceName(self, grp):
+        """Generate device name for a group"""
+        return f"Group: {grp.name or 'Unnamed Group'}"
+
+    def generateDomainDeviceName(self, dom):
+        """Generate device name for an exact allow/deny domain"""
+        return f"{'Allow' if dom.type.startswith('allow') else 'Deny'}: {dom.name}"
+
+    def generateClientGroupDeviceName(self, membership):
+        """Generate device name for the membership of a client in a group"""
+        group_name = self.group_names.get(membership.type, f"Group {membership.type}")
+        return f"Client: {membership.name or membership.address} in {group_name}"
+
+    def clientGroupEntries(self, payload):
+        """Expand every client into one membership entry per known group"""
+        if not self.groups.records:
+            # Without the group names the memberships are unknown; keep the devices as they are
+            raise ValueError("groups not known yet")
+        for client in payload['clients']:
+            groups = client.get('groups', [])
+            for group_id in self.groups.records:
+                yield {"id": f"{client.get('client')}#{group_id}", "client": client.get('client'),
+                       "name": client.get('name'), "comment": client.get('comment'), "groups": groups,
+                       "group": group_id, "enabled": group_id in groups}
+
+    def createEntityDevice(self, spec, record):
+        """Create a new switch device for a list, group, domain or client group membership"""
         
-        device_name = self.generateListDeviceName(lst)
-        enabled = lst.get('enabled', False)
+        device_name = spec.name(record)
         
-        # Find next available unit in lists range
-        unit = self.UNIT_LISTS_START
-        while unit in Devices or unit in self.lists_map.values():
-            unit += 1
-            if unit >= self.UNIT_GROUPS_START:
-                Domoticz.Error("No available units for lists")
-                return
+        # Take the lowest free unit in the ranges of this entity type
+        unit = spec.registry.allocate(record.id, lambda unit: unit in Devices)
+        if unit is None:
+            Domoticz.Error(f"No available units for {spec.collection}, all {spec.registry.capacity()} are in use; "
+                           f"widen the {spec.kind}_units advanced option")
+            return
         
-        # Store list_id in device description for persistence
-        description = f"ListID:{list_id}"
+        # Store the entity ID in device description for persistence
+        description = f"{spec.prefix}{record.id}"
         
         Domoticz.Device(Name=device_name, Unit=unit, 
                       TypeName="Switch", Switchtype=0, 
                       Description=description, Used=1).Create()
         
-        # Update mapping
-        self.lists_map[list_id] = unit
-        
         # Set initial state
-        nValue = 1 if enabled else 0
-        sValue = "On" if enabled else "Off"
-        Devices[unit].Update(nValue=nValue, sValue=sValue)
+        nValue = 1 if record.enabled else 0
+        sValue = "On" if record.enabled else "Off"
+        self.updateDevice(unit, nValue, sValue)
         
-        Domoticz.Log(f"Created device for list ID {list_id}: {device_name} (Unit {unit})")
+        Domoticz.Log(f"Created device for {spec.kind} ID {record.id}: {device_name} (Unit {unit})")
 
-    def createGroupDevice(self, group_id, grp):
-        """Create a new device for a group"""
-        
-        device_name = f"Group: {grp.get('name', 'Unnamed Group')}"
-        enabled = grp.get('enabled', True)
-        
-        # Find next available unit in groups range
-        unit = self.UNIT_GROUPS_START
-        while unit in Devices or unit in self.groups_map.values():
-            unit += 1
+    def updateStatistics(self):
+        """Update statistics devices"""
         
-        # Store group_id in device description for persistence
-        description = f"GroupID:{group_id}"
-        
-        Domoticz.Device(Name=device_name, Unit=unit, 
-                      TypeName="Switch", Switchtype=0, 
-                      Description=description, Used=1).Create()
-        
-        # Update mapping
-        self.groups_map[group_id] = unit
+        # Get complete statistics from /stats/summary, of every Pi-hole at the same time
+        if len(self.targets) == 1:
+            self.apiGet("/stats/summary", self.applyStatistics)
+        else:
+            summaries = {}
+            
+            def onSummary(target, summary):
+                summaries[target.address] = summary
+                if len(summaries) == len(self.targets):
+                    self.applyStatistics(self.mergeSummaries(summaries))
+            for target in self.targets:
+                self.apiGet("/stats/summary", functools.partial(onSummary, target), target)
+        
+        # Fetch only the query log rows added since the last cycle; every page has its own
+        # endpoint and is never asked for again, so it bypasses the response cache
+        if self.ingester:
+            self.fetchQueries(QueryIngester.PAGES_PER_CYCLE)
+
+    def mergeSummaries(self, summaries):
+        """Combine the /stats/summary of several Pi-holes into one
+        Query counters are summed. Clients and domains may be seen by more than one
+        Pi-hole and the block lists are the same everywhere, so those take the highest value.
+        A Pi-hole that did not answer contributes its last summary, so the sums do not drop
+        and look like a counter reset to the rates.
+        """
+        answered = {address: summary for address, summary in summaries.items()
+                    if summary and 'queries' in summary}
+        self.last_summaries.update(answered)
+        missing = [address for address in summaries if address not in answered]
+        if missing:
+            known = [address for address in missing if address in self.last_summaries]
+            Domoticz.Error(f"No statistics from {', '.join(missing)}, "
+                           f"using the last known ones of {len(known)} of them")
+            answered.update((address, self.last_summaries[address]) for address in known)
+        if not answered:
+            return None
         
-        # Set initial state
-        nValue = 1 if enabled else 0
-        sValue = "On" if enabled else "Off"
-        Devices[unit].Update(nValue=nValue, sValue=sValue)
+        merged = {"queries": {}, "clients": {}, "gravity": {}}
+        for summary in answered.values():
+            for section, key, combine in (("queries", "total", sum), ("queries", "blocked", sum),
+                                          ("queries", "forwarded", sum), ("queries", "cached", sum),
+                                          ("queries", "unique_domains", max), ("clients", "active", max),
+                                          ("clients", "total", max), ("gravity", "domains_being_blocked", max)):
+                value = summary.get(section, {}).get(key, 0)
+                current = merged[section].get(key)
+                merged[section][key] = value if current is None else combine((current, value))
+        # A Pi-hole that never answered is missing from the sums; they would jump once it does
+        merged["partial"] = len(answered) < len(summaries)
+        queries = merged["queries"]
+        queries["percent_blocked"] = queries["blocked"] * 100 / queries["total"] if queries["total"] else 0
+        return merged
+
+    def fetchQueries(self, pages, new=0):
+        """Request the next page of the query log scan; pages is what this cycle may still fetch"""
+        self.apiRequest("GET", self.ingester.endpoint(time.time()),
+                        callback=lambda status, result: self.applyQueries(result if status == 200 else None,
+                                                                          pages, new))
+
+    def applyQueries(self, result, pages=1, new=0):
+        """Count new query log rows and publish the watched client/domain totals"""
+        if not result or 'queries' not in result:
+            Domoticz.Error("Failed to get the query log from Pi-hole")
+            return
         
-        Domoticz.Log(f"Created device for group ID {group_id}: {device_name} (Unit {unit})")
+        new += self.ingester.ingest(result)
+        if self.ingester.scan and pages > 1:
+            self.fetchQueries(pages - 1, new)
+            return
+        if self.ingester.scan:
+            self.ingester.deferred += 1
+            Domoticz.Debug(f"Query log: more than {QueryIngester.PAGES_PER_CYCLE} pages of new rows, "
+                           f"continuing at row {self.ingester.scan[2]} in the next cycle")
+        Domoticz.Debug(f"Query log: {new} new rows, {self.ingester.ingested} counted since start, "
+                       f"{self.ingester.deferred} deferred cycles")
+        
+        for key, total in self.ingester.totals(time.time()).items():
+            unit = self.watch.unitFor(key)
+            if unit is not None:
+                self.updateDevice(unit, 0, str(total))
 
-    def getListIdFromUnit(self, unit):
-        """Get list ID from unit number"""
-        for list_id, mapped_unit in self.lists_map.items():
-            if mapped_unit == unit:
-                return list_id
-        return None
+    def createQueryIngester(self):
+        """Create the query log ingester when clients or domains are watched"""
+        clients = [c.strip() for c in self.options["watch_clients"].split(',') if c.strip()]
+        domains = [d.strip().lower() for d in self.options["watch_domains"].split(',') if d.strip()]
+        if not clients and not domains:
+            return None
+        window = max(1, self.options["watch_window"])
+        return QueryIngester(clients, domains, window, max(1, self.options["query_page"]))
 
-    def getGroupIdFromUnit(self, unit):
-        """Get group ID from unit number"""
-        for group_id, mapped_unit in self.groups_map.items():
-            if mapped_unit == unit:
-                return group_id
-        return None
+    def syncWatchDevices(self):
+        """Create a query counter device per watched client/domain and remove unwatched ones"""
+        for unit, device in Devices.items():
+            if device.Description.startswith("Watch:"):
+                self.watch.add(device.Description[len("Watch:"):], unit)
+        
+        watched = self.ingester.counters if self.ingester else {}
+        for key in [key for key in self.watch.ids() if key not in watched]:
+            unit = self.watch.release(key)
+            Domoticz.Log(f"Removing query counter for {key} (Unit {unit})")
+            Devices[unit].Delete()
+            self.writer.forget(unit)
+        
+        for key in watched:
+            if key in self.watch:
+                continue
+            unit = self.watch.allocate(key, lambda unit: unit in Devices)
+            if unit is None:
+                Domoticz.Error(f"No available units for the query counter of {key}")
+                continue
+            kind, _, value = key.partition(':')
+            name = f"Queries {'from' if kind == 'client' else 'to'} {value} ({self.ingester.window // 60} min)"
+            Domoticz.Device(Name=name, Unit=unit, TypeName="Custom", Options={"Custom": "1;queries"},
+                            Description=f"Watch:{key}", Used=1).Create()
+            Domoticz.Log(f"Created query counter for {key} (Unit {unit})")
 
-    def updateDevices(self):
-        """Update all device values"""
-        
-        # Get complete statistics from /stats/summary
-        summary = self.apiGet("/stats/summary")
+    def updateStates(self):
+        """Update blocking, list, group, domain and client devices states"""
+        self.apiGet("/dns/blocking", self.applyBlocking)
+        for spec in self.entities.values():
+            self.apiGet(spec.endpoint, functools.partial(self.applyStates, spec))
+
+    def applyStatistics(self, summary):
+        """Apply a /stats/summary response to the statistics devices"""
         if not summary or 'queries' not in summary:
             Domoticz.Error("Failed to get statistics from Pi-hole")
             return
         
+        self.updateStatus()
+        if not summary.get('partial'):
+            self.applyRates(summary['queries'])
+        if not self.changes.changed("stats:/stats/summary", summary):
+            Domoticz.Debug("Statistics unchanged, skipping")
+            return
+        self.last_stats = summary
+        self.showStatistics(summary)
+
+    def showStatistics(self, summary):
+        """Write the counters of a /stats/summary to the statistics devices"""
         queries = summary['queries']
         clients = summary['clients']
         gravity = summary['gravity']
@@ -472,258 +2993,499 @@ class PiHolePlugin:
         self.updateDevice(self.UNIT_CLIENTS_EVER, 0, str(total_clients))
         self.updateDevice(self.UNIT_UNIQUE_CLIENTS, 0, str(active_clients))
         self.updateDevice(self.UNIT_UNIQUE_DOMAINS, 0, str(unique_domains))
-        self.updateDevice(self.UNIT_STATUS, 1, "On")  # Pi-hole is responding
-        
-        # Update list devices states
-        lists_data = self.apiGet("/lists")
-        if lists_data and 'lists' in lists_data:
-            for lst in lists_data['lists']:
-                list_id = lst.get('id')
-                if list_id in self.lists_map:
-                    unit = self.lists_map[list_id]
-                    enabled = lst.get('enabled', False)
-                    nValue = 1 if enabled else 0
-                    sValue = "On" if enabled else "Off"
-                    self.updateDevice(unit, nValue, sValue)
-        
-        # Update group devices states
-        groups_data = self.apiGet("/groups")
-        if groups_data and 'groups' in groups_data:
-            for grp in groups_data['groups']:
-                group_id = grp.get('id')
-                if group_id in self.groups_map:
-                    unit = self.groups_map[group_id]
-                    enabled = grp.get('enabled', True)
-                    nValue = 1 if enabled else 0
-                    sValue = "On" if enabled else "Off"
-                    self.updateDevice(unit, nValue, sValue)
 
-    def updateDevice(self, unit, nValue, sValue):
-        """Update device only if value changed"""
-        if unit in Devices:
-            if Devices[unit].nValue != nValue or Devices[unit].sValue != sValue:
-                Devices[unit].Update(nValue=nValue, sValue=sValue)
+    def applyRates(self, queries):
+        """Add a statistics sample and publish the query rates derived from it"""
+        self.rates.add(time.time(), queries)
+        for unit, metric, window, per in (
+                (self.UNIT_QUERIES_PER_MINUTE, "total", 60, 60),
+                (self.UNIT_BLOCKED_PER_MINUTE, "blocked", 60, 60),
+                (self.UNIT_QUERIES_PER_HOUR, "total", 3600, 3600),
+                (self.UNIT_BLOCKED_PER_HOUR, "blocked", 3600, 3600)):
+            rate = self.rates.rate(metric, window, per)
+            if rate is not None:
+                self.updateDevice(unit, 0, f"{rate:.1f}")
 
-    def authenticate(self):
-        """Authenticate with Pi-hole API"""
-        try:
-            # Strip trailing slash from URL if present
-            base_url = Parameters['Address'].rstrip('/')
-            url = f"{base_url}/api/auth"
-            
-            data = json.dumps({"password": Parameters["Password"]}).encode('utf-8')
-            
-            req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
-            response = urllib.request.urlopen(req, timeout=5)
-            
-            result = json.loads(response.read().decode('utf-8'))
+    def applyBlocking(self, blocking):
+        """Apply a /dns/blocking response to the blocking selector and timer devices"""
+        if not blocking or 'blocking' not in blocking:
+            Domoticz.Error("Failed to get the blocking state from Pi-hole")
+            return
+        
+        timer = blocking.get('timer')
+        if blocking['blocking'] == "enabled":
+            level = 0
+            text = "Blocking enabled"
+        elif timer:
+            # Keep the pause level that was chosen, otherwise take the shortest one that covers the timer
+            # Read through the writer, the level set by setBlocking is not written until the callback returns
+            current = self.writer.current(self.UNIT_BLOCKING)
+            level = int(current[1] or 0) if current else 0
+            if not self.BLOCKING_LEVELS.get(level):
+                level = min((lvl for lvl, seconds in self.BLOCKING_LEVELS.items() if seconds and seconds >= timer),
+                            default=30)
+            minutes, seconds = divmod(int(timer), 60)
+            text = f"Paused, blocking resumes in {minutes}:{seconds:02d}"
+        else:
+            level = 40
+            text = f"Blocking {blocking['blocking']}"
+        
+        self.updateDevice(self.UNIT_BLOCKING, 1 if level else 0, str(level))
+        self.updateDevice(self.UNIT_BLOCKING_TIMER, 0, text)
+
+    def setBlocking(self, level):
+        """Enable blocking or pause it for the duration of the selector level with one POST"""
+        if level not in self.BLOCKING_LEVELS:
+            Domoticz.Error(f"Unknown blocking level {level}")
+            return
+        timer = self.BLOCKING_LEVELS[level]
+        data = {"blocking": level == 0, "timer": timer or None}
+        
+        def onResult(status, result):
+            if not self.checkWriteResult(status, result, "blocking"):
+                return
+            self.cache.invalidate("/dns/blocking")
+            Domoticz.Log(f"Blocking {'enabled' if level == 0 else 'disabled'}"
+                         f"{f' for {timer // 60} min' if timer else ''}")
+            # Pi-hole answers with the new state, the same as a GET would return
+            self.updateDevice(self.UNIT_BLOCKING, 1 if level else 0, str(level))
+            self.applyBlocking(result)
+        
+        self.apiWrite("POST", "/dns/blocking", data, onResult, "blocking")
+
+    def startGravity(self):
+        """Start a gravity rebuild on every Pi-hole (only the primary without fan_out)"""
+        if self.gravity:
+            Domoticz.Log("Gravity rebuild already running")
+            return
+        targets = self.targets if self.options["fan_out"] else self.targets[:1]
+        targets = [target for target in targets if target.breaker.isClosed()]
+        if not targets:
+            self.updateDevice(self.UNIT_GRAVITY_STATUS, 0, "Pi-hole is not responding")
+            return
+        
+        stale = [target for target in targets if target.session.needsRenewal()]
+        if stale:
+            # The rebuild needs a valid session; start once all sessions are renewed
+            remaining = [len(stale)]
             
+            def onAuthenticated(success):
+                remaining[0] -= 1
+                if not remaining[0]:
+                    self.runGravity([target for target in targets if target.session.sid])
+            for target in stale:
+                self.authenticate(onAuthenticated, target)
+            return
+        self.runGravity(targets)
+
+    def runGravity(self, targets):
+        if not targets:
+            self.updateDevice(self.UNIT_GRAVITY_STATUS, 0, "Gravity update failed: not authenticated")
+            return
+        Domoticz.Log(f"Starting gravity rebuild on {', '.join(target.address for target in targets)}")
+        for target in targets:
+            self.gravity[target] = GravityRunner(target.address, target.session.sid)
+        self.updateDevice(self.UNIT_GRAVITY_STATUS, 0, "Gravity update started")
+        self.updateHeartbeat()
+
+    def pollGravity(self):
+        """Show the latest progress line of the running rebuilds and their result once all ended"""
+        latest = None
+        for target, runner in self.gravity.items():
+            lines = runner.poll()
+            for line in lines:
+                Domoticz.Debug(f"Gravity {target.address}: {line}")
+            if lines and target is next(iter(self.gravity)):
+                latest = lines[-1]
+        if latest:
+            self.updateDevice(self.UNIT_GRAVITY_STATUS, 0, latest)
+        if not all(runner.isDone() for runner in self.gravity.values()):
+            return
+        
+        failed = [(target, message) for target, (success, message) in
+                  ((target, runner.result) for target, runner in self.gravity.items()) if not success]
+        self.gravity = {}
+        self.updateHeartbeat()
+        if failed:
+            for target, message in failed:
+                Domoticz.Error(f"Gravity rebuild on {target.address} failed: {message}")
+            self.updateDevice(self.UNIT_GRAVITY_STATUS, 0, f"Gravity update failed: {failed[0][1]}")
+        else:
+            Domoticz.Log("Gravity rebuild finished")
+            self.updateDevice(self.UNIT_GRAVITY_STATUS, 0, f"Gravity updated {time.strftime('%Y-%m-%d %H:%M')}")
+        
+        # The rebuild changes the number of blocked domains
+        for target in self.targets:
+            self.cache.invalidate("/stats/summary" if target is self.primary else target.address + "/stats/summary")
+        self.scheduler.trigger(self.TIER_STATS)
+
+    def applyStates(self, spec, payload):
+        """Apply enabled states from a response to the devices of one entity type"""
+        if not payload or spec.collection not in payload:
+            return
+        key = f"state:{spec.endpoint}"
+        if not self.changes.changed(key, payload):
+            Domoticz.Debug(f"{spec.label} states unchanged, skipping")
+            return
+        try:
+            entries = list(spec.entries(payload))
+        except ValueError as e:
+            Domoticz.Debug(f"Skipping {spec.kind} states: {e}")
+            self.changes.forget(key)
+            return
+        changed = self.changes.changedEntries(key, entries)
+        for entity_id, entry in changed.items():
+            unit = spec.registry.unitFor(entity_id)
+            if unit is not None:
+                record = spec.registry.records[entity_id] = spec.record(entry)
+                enabled = record.enabled
+                nValue = 1 if enabled else 0
+                sValue = "On" if enabled else "Off"
+                self.updateDevice(unit, nValue, sValue)
+        Domoticz.Debug(f"{spec.label} states: {len(changed)} reconciled, "
+                       f"{len(entries) - len(changed)} unchanged")
+
+    def updateDevice(self, unit, nValue, sValue):
+        """Update device only if value changed; writes are merged until the callback returns"""
+        self.writer.update(unit, nValue, sValue)
+
+    def authenticate(self, callback=None, target=None):
+        """Authenticate with Pi-hole API; callback(success) runs once Pi-hole has answered
+        Works with the web interface password as well as with an app password; an
+        app password also bypasses two-factor authentication.
+        """
+        target = target or self.primary
+        if target.auth_waiters:
+            # Authentication already in flight, share its outcome
+            target.auth_waiters.append(callback)
+            return
+        
+        target.auth_waiters = [callback]
+        data = {"password": target.password}
+        self.apiRequest("POST", "/auth", data, functools.partial(self.onAuthResponse, target),
+                        authenticated=False, target=target)
+
+    def onAuthResponse(self, target, status, result):
+        success = False
+        if result is None:
+            Domoticz.Error(f"Authentication error at {target.address}: "
+                           f"{'HTTP ' + str(status) if status else 'no response from Pi-hole'}")
+        else:
             session = result.get('session', {})
             if not session.get('valid'):
-                Domoticz.Error(f"Authentication failed: {session.get('message', 'Unknown error')}")
-                return False
-            
-            self.sid = session.get('sid')
-            
-            if self.sid:
-                Domoticz.Log(f"Authenticated successfully with Pi-hole at {Parameters['Address']}")
-                return True
+                message = session.get('message') or result.get('error', {}).get('message', 'Unknown error')
+                if session.get('totp'):
+                    message += " (2FA is enabled, use an app password instead)"
+                Domoticz.Error(f"Authentication failed at {target.address}: {message}")
+            elif session.get('sid'):
+                target.session.start(session['sid'], session.get('validity', 300))
+                Domoticz.Log(f"Authenticated successfully with Pi-hole at {target.address}")
+                Domoticz.Debug(f"Session valid for {target.session.validity}s ({session.get('message')})")
+                success = True
             else:
                 Domoticz.Error("Authentication failed: No SID received")
-                return False
+        
+        waiters, target.auth_waiters = target.auth_waiters, []
+        for waiter in waiters:
+            if waiter:
+                waiter(success)
+
+    def logout(self, target):
+        """Delete the session on Pi-hole so it does not keep occupying an API seat"""
+        if not target.session.sid:
+            return
+        
+        def onResponse(status, result):
+            if status is not None and status < 300:
+                Domoticz.Debug(f"Logged out from Pi-hole at {target.address}")
+            else:
+                Domoticz.Debug(f"Logout failed: {status if status else 'no response'}")
+        
+        # Use a short blocking request, the plugin is about to be unloaded
+        transport = BlockingTransport(target.address, target.getSid, timeout=2)
+        transport.request("DELETE", "/auth", callback=onResponse)
+        transport.stop()
+        target.session.invalidate()
+
+    def apiRequest(self, verb, endpoint, data=None, callback=None, authenticated=True, retry=True, target=None):
+        """Queue a request to Pi-hole API; callback(status, result) receives the decoded JSON
+        A request rejected with HTTP 401 re-authenticates and is retried once. While the
+        circuit breaker is open the request fails at once with status None. Requests go
+        to the primary Pi-hole unless another target is given.
+        """
+        target = target or self.primary
+        if not target.breaker.isClosed():
+            Domoticz.Debug(f"Pi-hole at {target.address} is down, not sending {verb} {endpoint}")
+            if callback:
+                callback(None, None)
+            return
+        
+        sent_sid = target.session.sid
+        
+        def onResponse(status, result):
+            self.recordOutcome(status, target)
+            if authenticated and status == 401 and retry:
+                def onAuthenticated(success):
+                    if success:
+                        self.apiRequest(verb, endpoint, data, callback, retry=False, target=target)
+                    elif callback:
+                        callback(status, result)
                 
-        except Exception as e:
-            Domoticz.Error(f"Authentication error: {str(e)}")
-            return False
+                if target.session.sid and target.session.sid != sent_sid:
+                    # Another rejected request of the same batch has already logged in again
+                    onAuthenticated(True)
+                    return
+                Domoticz.Debug(f"Session rejected on {verb} {endpoint}, re-authenticating")
+                # Only the request that used the current session ends it; later ones join that login
+                if target.session.sid == sent_sid:
+                    target.session.invalidate()
+                self.authenticate(onAuthenticated, target)
+                return
+            if authenticated and status is not None and status < 400:
+                target.session.touch()
+            if callback:
+                callback(status, result)
+        
+        target.transport.request(verb, endpoint, data, onResponse, authenticated)
 
-    def apiGet(self, endpoint):
-        """Make GET request to Pi-hole API"""
-        try:
-            # Strip trailing slash from URL if present
-            base_url = Parameters['Address'].rstrip('/')
-            url = f"{base_url}/api{endpoint}"
-            
-            req = urllib.request.Request(url)
-            
-            if self.sid:
-                req.add_header('X-FTL-SID', self.sid)
-            
-            response = urllib.request.urlopen(req, timeout=5)
-            return json.loads(response.read().decode('utf-8'))
-            
-        except urllib.error.HTTPError as e:
-            Domoticz.Debug(f"HTTP Error on {endpoint}: {e.code} - {e.reason}")
-            return None
-        except Exception as e:
-            Domoticz.Debug(f"API GET error on {endpoint}: {str(e)}")
-            return None
+    def apiWrite(self, verb, endpoint, data, callback, label):
+        """Send a change to the primary Pi-hole and, with fan_out, to all the others at the same time
+        callback(status, result) receives the answer of the primary once every Pi-hole has
+        answered; failures of the other Pi-holes are reported per Pi-hole.
+        """
+        targets = self.targets if self.options["fan_out"] else self.targets[:1]
+        answers = {}
+        
+        def onResponse(target, status, result):
+            answers[target.index] = (status, result)
+            if len(answers) < len(targets):
+                return
+            failed = [other.address for other in targets[1:]
+                      if not self.checkWriteResult(*answers[other.index], f"{label} at {other.address}")]
+            if failed:
+                Domoticz.Error(f"Changing {label} failed on {len(failed)} of {len(targets)} Pi-holes: "
+                               f"{', '.join(failed)}")
+            callback(*answers[self.primary.index])
+        
+        # One batch, so blocking transports of different Pi-holes send at the same time
+        with self.transport.batch():
+            for target in targets:
+                self.apiRequest(verb, endpoint, data, functools.partial(onResponse, target), target=target)
 
-    def setListState(self, list_id, enabled):
-        """Enable or disable a block list - Pi-hole v6 API
-        Uses PUT on /lists/{address}?type=block with enabled boolean
-        Based on: https://discourse.pi-hole.net/t/enable-disable-lists-via-api/82763
+    def recordOutcome(self, status, target):
+        """Feed the outcome of a request to the circuit breaker and reflect it on the status device"""
+        if status is None or status >= 500:
+            delay = target.breaker.recordFailure()
+            if delay is not None:
+                Domoticz.Error(f"Pi-hole at {target.address} is not responding, "
+                               f"next attempt in {delay:.0f}s")
+                self.updateStatus()
+        elif target.breaker.recordSuccess():
+            Domoticz.Log(f"Pi-hole at {target.address} is responding again")
+            self.updateStatus()
+
+    def updateStatus(self):
+        """The status switch is On while every Pi-hole is responding"""
+        up = all(target.breaker.isClosed() for target in self.targets)
+        self.updateDevice(self.UNIT_STATUS, 1 if up else 0, "On" if up else "Off")
+
+    def probe(self, target):
+        """Send one cheap unauthenticated request to find out whether Pi-hole is back"""
+        Domoticz.Debug(f"Probing Pi-hole at {target.address}")
+        
+        def onResponse(status, result):
+            self.recordOutcome(status, target)
+            if target.breaker.isClosed():
+                # Catch up on everything missed while Pi-hole was down
+                self.scheduler.trigger(*self.scheduler.intervals)
+        
+        target.transport.request("GET", "/auth", callback=onResponse, authenticated=False)
+
+    def apiGet(self, endpoint, callback, target=None):
+        """Make GET request to Pi-hole API; callback receives the decoded JSON or None on error
+        Responses are served from the per-cycle cache and concurrent GETs of the
+        same endpoint share a single request.
         """
-        try:
-            # Get current list data to find its address
-            lists_data = self.apiGet("/lists")
-            if not lists_data or 'lists' not in lists_data:
-                Domoticz.Error("Failed to get lists data")
-                return False
-            
-            # Find the list by ID to get its address
-            target_list = None
-            for lst in lists_data['lists']:
-                if lst.get('id') == list_id:
-                    target_list = lst
-                    break
-            
-            if not target_list:
-                Domoticz.Error(f"List ID {list_id} not found")
-                return False
-            
-            list_address = target_list.get('address', '')
-            list_type = target_list.get('type', 'block')
-            
-            if not list_address:
-                Domoticz.Error(f"List ID {list_id} has no address")
-                return False
-            
-            # URL encode the address
-            encoded_address = urllib.parse.quote(list_address, safe='')
-            
-            # Strip trailing slash from URL if present
-            base_url = Parameters['Address'].rstrip('/')
-            
-            # PUT to /lists/{encoded_address}?type={type}
-            url = f"{base_url}/api/lists/{encoded_address}?type={list_type}"
-            
-            # Send ALL fields from current list to preserve comment, groups, etc.
-            update_data = {
-                "enabled": enabled,
-                "comment": target_list.get('comment', ''),
-                "groups": target_list.get('groups', []),
-                "address": list_address,
-                "type": list_type
-            }
-            
-            data = json.dumps(update_data).encode('utf-8')
-            
-            req = urllib.request.Request(url, data=data, method='PUT',
-                                        headers={'Content-Type': 'application/json'})
-            
-            if self.sid:
-                req.add_header('X-FTL-SID', self.sid)
-            
-            response = urllib.request.urlopen(req, timeout=5)
-            result = json.loads(response.read().decode('utf-8'))
-            
-            Domoticz.Debug(f"PUT result: {result}")
-            
-            # Check for errors
-            if 'error' in result:
-                Domoticz.Error(f"API error: {result['error']}")
-                return False
-            
-            # Check processed results
-            if 'processed' in result:
-                errors = result['processed'].get('errors', [])
-                if errors:
-                    Domoticz.Error(f"Error updating list {list_id}: {errors}")
-                    return False
-            
-            Domoticz.Log(f"Successfully set list {list_id} ('{target_list.get('comment')}') to {'enabled' if enabled else 'disabled'}")
-            return True
-            
-        except urllib.error.HTTPError as e:
-            try:
-                error_body = e.read().decode('utf-8')
-                error_data = json.loads(error_body)
-                Domoticz.Error(f"HTTP Error {e.code}: {error_data}")
-            except:
-                Domoticz.Error(f"HTTP Error {e.code}: {e.reason}")
+        target = target or self.primary
+        # Responses of the primary are cached under the bare endpoint, those of others under their address
+        key = endpoint if target is self.primary else target.address + endpoint
+        if key in self.inflight:
+            self.coalesced += 1
+            self.inflight[key].append(callback)
+            return
+        
+        cached = self.cache.get(key)
+        if cached is not None:
+            callback(cached)
+            return
+        
+        def onResponse(status, result):
+            if status == 200 and result is not None:
+                self.cache.put(key, result)
+            else:
+                Domoticz.Debug(f"API GET on {key} failed: {status if status else 'no response'}")
+                result = None
+            for waiter in self.inflight.pop(key, []):
+                waiter(result)
+        
+        self.inflight[key] = [callback]
+        self.apiRequest("GET", endpoint, callback=onResponse, target=target)
+
+    def checkWriteResult(self, status, result, label):
+        """Check the response of a PUT request, log errors and return True on success"""
+        if status is None:
+            Domoticz.Error(f"Error updating {label}: no response from Pi-hole")
             return False
-        except Exception as e:
-            Domoticz.Error(f"Error setting list state: {str(e)}")
+        
+        if status >= 400:
+            Domoticz.Error(f"HTTP Error {status}: {result}")
             return False
-
-    def setGroupState(self, group_id, enabled):
-        """Enable or disable a group - Pi-hole v6 API"""
-        Domoticz.Log("=== NEW CODE VERSION 2023-11-23 v2 EXECUTING ===")
-        try:
-            # Get current group data
-            groups_data = self.apiGet("/groups")
-            if not groups_data or 'groups' not in groups_data:
-                Domoticz.Error("Failed to get groups data")
-                return False
-            
-            # Find the group by ID
-            target_group = None
-            for grp in groups_data['groups']:
-                if grp.get('id') == group_id:
-                    target_group = grp
-                    break
-            
-            if not target_group:
-                Domoticz.Error(f"Group ID {group_id} not found")
+        
+        result = result or {}
+        Domoticz.Debug(f"PUT result: {result}")
+        
+        # Check for errors
+        if 'error' in result:
+            Domoticz.Error(f"API error: {result['error']}")
+            return False
+        
+        # Check processed results
+        if 'processed' in result:
+            errors = result['processed'].get('errors', [])
+            if errors:
+                Domoticz.Error(f"Error updating {label}: {errors}")
                 return False
-            
-            # Strip trailing slash from URL if present
-            base_url = Parameters['Address'].rstrip('/')
+        
+        return True
+
+    def listUpdate(self, lst, enabled):
+        """PUT /lists/{address}?type={type} with all fields so comment, groups, etc. are preserved
+        Based on: https://discourse.pi-hole.net/t/enable-disable-lists-via-api/82763
+        """
+        if not lst.address:
+            return None
+        list_type = lst.type or 'block'
+        return f"/lists/{urllib.parse.quote(lst.address, safe='')}?type={list_type}", {
+            "enabled": enabled,
+            "comment": lst.comment or '',
+            "groups": list(lst.groups),
+            "address": lst.address,
+            "type": list_type
+        }
 
-            # Pi-hole API uses group NAME in URL, not ID!
-            # URL encode the name to handle spaces and special characters
-            group_name = target_group.get('name', '')
-            encoded_group_name = urllib.parse.quote(group_name, safe='')
-            url = f"{base_url}/api/groups/{encoded_group_name}"
+    def groupUpdate(self, grp, enabled):
+        """PUT /groups/{name} with the same fields as the Pi-hole UI: name, comment, enabled"""
+        # Pi-hole API uses group NAME in URL, not ID!
+        group_name = grp.name or ''
+        return f"/groups/{urllib.parse.quote(group_name, safe='')}", {
+            "name": group_name,
+            "comment": grp.comment or '',
+            "enabled": enabled
+        }
 
-            # Send the same fields as Pi-hole UI: name, comment, enabled
-            update_data = {
-                "name": group_name,
-                "comment": target_group.get('comment') or '',
-                "enabled": enabled
-            }
+    def domainUpdate(self, dom, enabled):
+        """PUT /domains/{type}/{kind}/{domain}"""
+        domain_type, _, kind = dom.type.partition('/')
+        return f"/domains/{domain_type}/{kind}/{urllib.parse.quote(dom.address, safe='')}", {
+            "type": domain_type,
+            "kind": kind,
+            "comment": dom.comment or '',
+            "groups": list(dom.groups),
+            "enabled": enabled
+        }
 
-            Domoticz.Debug(f"Sending PUT to {url} with data: {update_data}")
+    def clientGroupUpdate(self, membership, enabled):
+        """PUT /clients/{client} with the group added to or removed from its groups"""
+        # A PUT for the same client still in flight is built upon, so a batch of commands
+        # for one client does not undo its own changes
+        groups = set(self.client_groups.get(membership.address, membership.groups))
+        if enabled:
+            groups.add(membership.type)
+        else:
+            groups.discard(membership.type)
+        groups = tuple(sorted(groups))
+        self.client_groups[membership.address] = groups
+        
+        return f"/clients/{urllib.parse.quote(membership.address, safe='')}", {
+            "comment": membership.comment or '',
+            "groups": list(groups)
+        }
 
-            data = json.dumps(update_data).encode('utf-8')
-            
-            req = urllib.request.Request(url, data=data, method='PUT',
-                                        headers={'Content-Type': 'application/json'})
-            
-            if self.sid:
-                req.add_header('X-FTL-SID', self.sid)
-            
-            response = urllib.request.urlopen(req, timeout=5)
-            result = json.loads(response.read().decode('utf-8'))
-            
-            Domoticz.Debug(f"PUT result: {result}")
+    def settleClientGroups(self, membership, groups, success):
+        """Apply the groups of a finished client PUT to all memberships of the client"""
+        if self.client_groups.get(membership.address) == groups:
+            del self.client_groups[membership.address]
+        if not success:
+            return
+        for record in self.entities["client"].registry.records.values():
+            if record.address == membership.address:
+                record.groups = groups
+
+    def setEntityState(self, spec, entity_id, enabled, callback):
+        """Enable or disable a list, group, domain or client group membership - Pi-hole v6 API
+        callback(success, confirmed) runs after Pi-hole has answered the PUT, with
+        confirmed the EntityRecord of the object returned by Pi-hole, if any
+        """
+        label = f"{spec.kind} {entity_id}"
+        
+        def send(record):
+            if not record:
+                Domoticz.Error(f"{spec.label} ID {entity_id} not found")
+                callback(False, None)
+                return
             
-            # Check for errors
-            if 'error' in result:
-                Domoticz.Error(f"API error: {result['error']}")
-                return False
+            request = spec.update(record, enabled)
+            if request is None:
+                Domoticz.Error(f"{spec.label} ID {entity_id} cannot be switched, it has no address")
+                callback(False, None)
+                return
+            endpoint, update_data = request
             
-            # Check processed results
-            if 'processed' in result:
-                errors = result['processed'].get('errors', [])
-                if errors:
-                    Domoticz.Error(f"Error updating group {group_id}: {errors}")
-                    return False
+            Domoticz.Debug(f"Sending PUT to {endpoint} with data: {update_data}")
             
-            Domoticz.Log(f"Successfully set group {group_id} ('{target_group.get('name')}') to {'enabled' if enabled else 'disabled'}")
-            return True
+            def onResult(status, result):
+                success = self.checkWriteResult(status, result, label)
+                if spec.kind == "client":
+                    self.settleClientGroups(record, tuple(update_data["groups"]), success)
+                if not success:
+                    callback(False, None)
+                    return
+                confirmed = None
+                returned = (result or {}).get(spec.collection)
+                if returned:
+                    for entry in spec.entries({spec.collection: returned}):
+                        if entry.get('id') == entity_id:
+                            confirmed = spec.registry.records[entity_id] = spec.record(entry)
+                if confirmed is None:
+                    record.enabled = enabled
+                self.cache.invalidate(spec.endpoint)
+                Domoticz.Log(f"Successfully set {label} ('{record.name}') to {'enabled' if enabled else 'disabled'}")
+                if spec.kind == "list" and self.options["auto_gravity"]:
+                    # Every further change postpones the rebuild, so a batch of changes causes only one
+                    self.gravity_due = time.time() + self.options["auto_gravity_delay"]
+                callback(True, confirmed)
             
-        except urllib.error.HTTPError as e:
+            self.apiWrite("PUT", endpoint, update_data, onResult, label)
+        
+        # The registry already holds the fields from the last sync; fetch them only if it does not
+        record = spec.registry.records.get(entity_id)
+        if record:
+            send(record)
+            return
+        
+        def onEntities(payload):
             try:
-                error_body = e.read().decode('utf-8')
-                error_data = json.loads(error_body)
-                Domoticz.Error(f"HTTP Error {e.code}: {error_data}")
-            except:
-                Domoticz.Error(f"HTTP Error {e.code}: {e.reason}")
-            return False
-        except Exception as e:
-            Domoticz.Error(f"Error setting group state: {str(e)}")
-            return False
+                entries = list(spec.entries(payload)) if payload and spec.collection in payload else None
+            except ValueError:
+                entries = None
+            if entries is None:
+                Domoticz.Error(f"Failed to get {spec.collection} data")
+                callback(False, None)
+                return
+            spec.registry.records.update((entry.get('id'), spec.record(entry)) for entry in entries)
+            send(spec.registry.records.get(entity_id))
+        
+        self.apiGet(spec.endpoint, onEntities)
 
 global _plugin
 _plugin = PiHolePlugin()
@@ -738,15 +3500,18 @@ def onStop():
 
 def onConnect(Connection, Status, Description):
     global _plugin
-    _plugin.onConnect(Connection, Status, Description)
+    with _plugin.callback("connect"):
+        _plugin.onConnect(Connection, Status, Description)
 
 def onMessage(Connection, Data):
     global _plugin
-    _plugin.onMessage(Connection, Data)
+    with _plugin.callback("message"):
+        _plugin.onMessage(Connection, Data)
 
 def onCommand(Unit, Command, Level, Hue):
     global _plugin
-    _plugin.onCommand(Unit, Command, Level, Hue)
+    with _plugin.callback("command"):
+        _plugin.onCommand(Unit, Command, Level, Hue)
 
 def onNotification(Name, Subject, Text, Status, Priority, Sound, ImageFile):
     global _plugin
@@ -754,9 +3519,11 @@ def onNotification(Name, Subject, Text, Status, Priority, Sound, ImageFile):
 
 def onDisconnect(Connection):
     global _plugin
-    _plugin.onDisconnect(Connection)
+    with _plugin.callback("disconnect"):
+        _plugin.onDisconnect(Connection)
 
 def onHeartbeat():
     global _plugin
-    _plugin.onHeartbeat()
+    with _plugin.callback("heartbeat"):
+        _plugin.onHeartbeat()
 